@@ -0,0 +1,195 @@
+import collections
+import logging
+import os
+import sys
+import threading
+import weakref
+from time import localtime, monotonic, strftime, time
+
+
+class BufferedWriter(object):
+    # items are appended to a ring buffer by the serving thread and are only
+    # formatted and written in batches by a background thread; when the
+    # output cannot keep up the oldest items are dropped instead of blocking
+
+    def __init__(self, stream=None, capacity=10000, flush_interval=0.5, batch_size=256):
+        self.stream = stream if stream is not None else sys.stderr
+        self.buffer = collections.deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.closed = False
+        self.start()
+        _open_writers.add(self)
+
+    def put(self, item):
+        buffer = self.buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append(item)
+        if len(buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    def start(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def after_fork(self):
+        # the thread of the parent does not exist in a forked child and the
+        # locks may have been held at the time; what is still buffered is
+        # written by the parent, a child writing it too would duplicate it
+        self.buffer.clear()
+        self.dropped = 0
+        self.start()
+
+    def run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines = []
+            buffer = self.buffer
+            while buffer:
+                lines.append(self.format(buffer.popleft()))
+            if self.dropped:
+                lines.append(f"{self.dropped} log lines dropped")
+                self.dropped = 0
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    pass
+
+    def format(self, item):
+        return str(item)
+
+    def close(self):
+        _open_writers.discard(self)
+        self.closed = True
+        if self.wakeup is not None:
+            self.wakeup.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+
+_open_writers = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for writer in list(_open_writers):
+        writer.after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class AccessLog(BufferedWriter):
+
+    def __init__(self, stream=None, fmt="common", **kwargs):
+        self.combined = fmt == "combined"
+        self.last_second = None
+        self.timestamp = None
+        super().__init__(stream, **kwargs)
+
+    def log(self, addr, method, uri, protocol, headers, status, size):
+        # only references are stored, the line is built by the writer thread
+        self.put((time(), addr, method, uri, protocol, headers, status, size))
+
+    def format(self, item):
+        when, addr, method, uri, protocol, headers, status, size = item
+        second = int(when)
+        if second != self.last_second:
+            self.last_second = second
+            self.timestamp = strftime("%d/%b/%Y:%H:%M:%S %z", localtime(second))
+
+        host = addr[0] if addr else "-"
+        request = escape(f"{method} {uri} {protocol}") if method is not None else "-"
+        line = f'{host} - - [{self.timestamp}] "{request}" {status} {size or "-"}'
+        if self.combined:
+            # header names arrive lower-cased from the request parser
+            referer = escape(headers.get("referer", "-"))
+            agent = escape(headers.get("user-agent", "-"))
+            line += f' "{referer}" "{agent}"'
+        return line
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def open_log(path):
+    if path in (None, "-"):
+        return sys.stdout
+    return open(path, "a", buffering=1024 * 1024)
+
+
+class BufferedHandler(logging.Handler):
+
+    def __init__(self, stream=None, **kwargs):
+        super().__init__()
+        self.writer = BufferedWriter(stream, **kwargs)
+        self.writer.format = self.format
+
+    def emit(self, record):
+        self.writer.put(record)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        super().close()
+
+
+class TraceSampler(logging.Filter):
+    # only DEBUG records are sampled, everything above always passes
+
+    def __init__(self, sample=1, rate=0):
+        super().__init__()
+        self.sample = max(sample, 1)
+        self.rate = rate
+        self.seen = 0
+        self.tokens = rate
+        self.last_refill = monotonic()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        self.seen += 1
+        if self.seen % self.sample:
+            return False
+        if self.rate:
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        return True
+
+
+def setup_logging(level=logging.INFO, filename=None,
+                  fmt="%(name)s: %(process)d %(message)s", sample=None, rate=None):
+    # the scripts without command line options can be tuned with the
+    # TRACE_SAMPLE (keep 1 of N) and TRACE_RATE (per second) variables
+    if sample is None:
+        sample = int(os.environ.get("TRACE_SAMPLE", 1))
+    if rate is None:
+        rate = float(os.environ.get("TRACE_RATE", 0))
+
+    stream = open_log(filename) if filename else sys.stderr
+    handler = BufferedHandler(stream)
+    handler.setFormatter(logging.Formatter(fmt))
+    handler.addFilter(TraceSampler(sample, rate))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
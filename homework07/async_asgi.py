@@ -0,0 +1,290 @@
+import asyncio
+import http
+import logging
+import os
+import urllib.parse
+
+import httpd
+
+
+log = logging.getLogger(__name__)
+
+ASGI_VERSION = {"version": "3.0", "spec_version": "2.3"}
+
+
+class AsyncASGIServer(httpd.AsyncServer):
+
+    def __init__(self, host="127.0.0.1", port=9000, reuse_port=False, use_uvloop=False,
+                 application=None, lifespan="auto"):
+        super().__init__(host=host, port=port, reuse_port=reuse_port, use_uvloop=use_uvloop)
+        self.handler_class = AsyncASGIRequestHandler
+        self.application = application
+        self.lifespan = lifespan
+        self.lifespan_task = None
+        self.lifespan_queue = None
+        self.lifespan_events = {}
+        self.lifespan_failure = None
+
+    def set_app(self, application):
+        self.application = application
+
+    def get_app(self):
+        return self.application
+
+    async def startup(self):
+        if self.lifespan == "off":
+            return
+
+        self.lifespan_queue = asyncio.Queue()
+        self.lifespan_events = {
+            "startup": asyncio.Event(),
+            "shutdown": asyncio.Event(),
+        }
+        self.lifespan_task = asyncio.ensure_future(self.run_lifespan())
+        await self.lifespan_queue.put({"type": "lifespan.startup"})
+        await self.wait_lifespan("startup")
+        if self.lifespan_failure is not None:
+            raise RuntimeError(f"ASGI application failed to start: {self.lifespan_failure}")
+
+    async def cleanup(self):
+        if self.lifespan_task is None or self.lifespan_task.done():
+            return
+
+        await self.lifespan_queue.put({"type": "lifespan.shutdown"})
+        await self.wait_lifespan("shutdown")
+        if self.lifespan_failure is not None:
+            log.error("ASGI application failed to shut down: %s", self.lifespan_failure)
+
+    async def wait_lifespan(self, phase):
+        # the application may also just return or raise instead of answering
+        event = asyncio.ensure_future(self.lifespan_events[phase].wait())
+        await asyncio.wait([event, self.lifespan_task], return_when=asyncio.FIRST_COMPLETED)
+        event.cancel()
+
+    async def run_lifespan(self):
+        scope = {"type": "lifespan", "asgi": ASGI_VERSION, "state": {}}
+        try:
+            await self.application(scope, self.lifespan_queue.get, self.lifespan_send)
+        except Exception as e:
+            if self.lifespan == "on" or self.lifespan_events["startup"].is_set():
+                self.lifespan_failure = repr(e)
+                log.error("Error in ASGI lifespan", exc_info=e)
+            else:
+                log.info("ASGI lifespan protocol is not supported by the application")
+
+    async def lifespan_send(self, message):
+        phase, _, result = message["type"].removeprefix("lifespan.").partition(".")
+        if result == "failed":
+            self.lifespan_failure = message.get("message", "")
+        self.lifespan_events[phase].set()
+
+
+class AsyncASGIRequestHandler(httpd.AsyncAppRequestHandler):
+
+    def __init__(self, server=None):
+        super().__init__(server)
+        self.body_ready = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.request_sent = False
+        self.response_started = False
+        self.response_complete_sent = False
+        self.status = None
+        self.response_headers = []
+        self.headers_sent = False
+        self.chunked = False
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.disconnected.set()
+        self.body_ready.set()
+
+    def parse_request(self, request):
+        self.body_ready.clear()
+        super().parse_request(request)
+        # the application is started before the body has arrived, unless
+        # the request was already answered with an error
+        if self.busy:
+            self.handle_request()
+
+    def read_body(self):
+        # the body is handed to the application as it arrives instead of
+        # being collected first
+        super().read_body()
+        if self.body_chunks:
+            self.body_ready.set()
+
+    def get_scope(self):
+        raw_path, _, query = self.uri.partition("?")
+        return {
+            "type": "http",
+            "asgi": ASGI_VERSION,
+            "http_version": self.protocol.removeprefix("HTTP/"),
+            "method": self.method,
+            "scheme": "http",
+            "path": urllib.parse.unquote(raw_path),
+            "raw_path": raw_path.encode("latin-1"),
+            "query_string": query.encode("latin-1"),
+            "root_path": "",
+            "headers": [
+                (key.encode("latin-1"), value.encode("latin-1"))
+                for key, value in self.headers.items()
+            ],
+            "client": self.addr,
+            "server": self.transport.get_extra_info("sockname")[:2],
+            "extensions": {"http.response.zerocopysend": {}},
+        }
+
+    def handle_request(self):
+        self.request_sent = False
+        self.response_started = False
+        self.response_complete_sent = False
+        self.headers_sent = False
+        self.chunked = False
+        asyncio.ensure_future(self.run_application(self.get_scope()))
+
+    async def run_application(self, scope):
+        try:
+            await self.server.get_app()(scope, self.receive, self.send)
+        except Exception as e:
+            if not self.connected:
+                return
+            log.error("Error in ASGI application", exc_info=e)
+            if self.response_started:
+                self.close()
+                return
+            self.busy = False
+            self.close_connection = True
+            self.send_error(500)
+            return
+
+        if not self.response_complete_sent and self.connected:
+            if self.response_started:
+                self.close()
+                return
+            self.busy = False
+            self.close_connection = True
+            self.send_error(500, "Internal Server Error")
+
+    async def receive(self):
+        if not self.request_sent:
+            while not self.body_chunks and self.body_remaining and self.connected:
+                self.body_ready.clear()
+                await self.body_ready.wait()
+            if self.connected:
+                body = b"".join(self.body_chunks)
+                self.body_chunks = []
+                self.request_sent = not self.body_remaining
+                return {"type": "http.request", "body": body, "more_body": not self.request_sent}
+
+        if not self.response_complete_sent:
+            await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if not self.connected:
+            raise ConnectionResetError("client disconnected")
+
+        kind = message["type"]
+        if kind == "http.response.start":
+            if self.response_started:
+                raise RuntimeError("http.response.start sent twice")
+            self.response_started = True
+            self.status = message["status"]
+            self.response_headers = message.get("headers", [])
+            return
+
+        if not self.response_started or self.response_complete_sent:
+            raise RuntimeError(f"unexpected ASGI message {kind!r}")
+
+        more_body = message.get("more_body", False)
+        head_only = self.method == "HEAD"
+        if kind == "http.response.body":
+            body = message.get("body", b"")
+            if not self.headers_sent:
+                self.send_asgi_headers(None if more_body else len(body))
+            if body and not head_only:
+                self.push(b"%x\r\n%s\r\n" % (len(body), body) if self.chunked else body)
+        elif kind == "http.response.zerocopysend":
+            file = message["file"]
+            offset = message.get("offset", file.tell())
+            count = message.get("count")
+            if count is None:
+                count = os.fstat(file.fileno()).st_size - offset
+            if not self.headers_sent:
+                self.send_asgi_headers(None if more_body else count)
+            if count and not head_only:
+                # the file belongs to the application, so it is not closed
+                # here, but send() only returns once it has been written
+                sent = asyncio.Event()
+                if self.chunked:
+                    self.push(b"%x\r\n" % count)
+                self.push_with_producer(httpd.SendfileProducer(
+                    file, offset=offset, count=count, release=sent.set))
+                if self.chunked:
+                    self.push(b"\r\n")
+                await sent.wait()
+        else:
+            raise RuntimeError(f"unexpected ASGI message {kind!r}")
+
+        if not more_body:
+            self.finish_response()
+        await self.can_write.wait()
+
+    def send_asgi_headers(self, length):
+        names = {name.lower() for name, _ in self.response_headers}
+        if b"content-length" not in names:
+            if length is not None:
+                self.response_headers = list(self.response_headers) + [(b"content-length", b"%d" % length)]
+            elif self.protocol == "HTTP/1.1":
+                self.chunked = True
+            else:
+                self.close_connection = True
+
+        try:
+            phrase = http.HTTPStatus(self.status).phrase
+        except ValueError:
+            phrase = ""
+        self.send_response(self.status, phrase)
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        for name, value in self.response_headers:
+            self.send_header(name.decode("latin-1"), value.decode("latin-1"))
+        self.end_headers()
+        self.headers_sent = True
+
+    def finish_response(self):
+        self.response_complete_sent = True
+        if self.chunked and self.method != "HEAD":
+            self.push(b"0\r\n\r\n")
+        self.busy = False
+        self.response_complete()
+        asyncio.get_running_loop().call_soon(self.process_requests)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/plain")],
+    })
+    await send({"type": "http.response.body", "body": b"Hello World"})
+
+
+def parse_args():
+    parser = httpd.app_arg_parser("Asynchronous ASGI server", "async_asgi:application")
+    parser.add_argument("--lifespan", dest="lifespan", choices=("auto", "on", "off"), default="auto")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    httpd.run_app_server(args, AsyncASGIServer, lifespan=args.lifespan)
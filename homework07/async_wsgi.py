@@ -1,26 +1,250 @@
+import asyncio
+import concurrent.futures
+import io
+import logging
+import os
+import sys
+import urllib.parse
+
 import httpd
+
+
+log = logging.getLogger(__name__)
+
+
+class FileWrapper(object):
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, "close"):
+            self.close = filelike.close
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.blksize)
+            if not data:
+                return
+            yield data
+
+    def file_range(self):
+        # only a real file can be sent with sendfile, file-likes such as
+        # BytesIO have a fileno() that raises when it is called and are
+        # iterated like any other response
+        try:
+            offset = self.filelike.tell()
+            return offset, os.fstat(self.filelike.fileno()).st_size - offset
+        except (AttributeError, OSError, ValueError):
+            return None
+
+
 class AsyncWSGIServer(httpd.AsyncServer):
 
+    def __init__(self, host="127.0.0.1", port=9000, reuse_port=False, use_uvloop=False,
+                 application=None, threads=None):
+        super().__init__(host=host, port=port, reuse_port=reuse_port, use_uvloop=use_uvloop)
+        self.handler_class = AsyncWSGIRequestHandler
+        self.application = application
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="wsgi")
+
     def set_app(self, application):
         self.application = application
 
     def get_app(self):
         return self.application
 
+    def serve_forever(self):
+        try:
+            super().serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
 
-class AsyncWSGIRequestHandler(httpd.AsyncHTTPRequestHandler):
+
+class AsyncWSGIRequestHandler(httpd.AsyncAppRequestHandler):
+
+    def __init__(self, server=None):
+        super().__init__(server)
+        self.status = None
+        self.response_headers = []
+        self.headers_sent = False
+        self.chunked = False
+
+    def read_body(self):
+        super().read_body()
+        if not self.body_remaining:
+            self.handle_request()
 
     def get_environ(self):
-        pass
+        path, _, query = self.uri.partition("?")
+        server_name, server_port = self.transport.get_extra_info("sockname")[:2]
+        environ = {
+            "REQUEST_METHOD": self.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": str(server_port),
+            "SERVER_PROTOCOL": self.protocol,
+            "SERVER_SOFTWARE": httpd.SERVER_NAME,
+            "REMOTE_ADDR": self.addr[0] if self.addr else "",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(b"".join(self.body_chunks)),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            "wsgi.file_wrapper": FileWrapper,
+        }
+        for key, value in self.headers.items():
+            if "_" in key:
+                # X-Foo and X_Foo would both become HTTP_X_FOO, a name with
+                # an underscore could otherwise pass for a header set by a
+                # proxy in front of the server
+                continue
+            name = key.upper().replace("-", "_")
+            if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+                environ[name] = value
+            else:
+                environ["HTTP_" + name] = value
+        return environ
 
     def start_response(self, status, response_headers, exc_info=None):
-        pass
+        if exc_info:
+            try:
+                if self.headers_sent:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("Headers already set")
+
+        self.status = status
+        self.response_headers = response_headers
+        return self.write
 
     def handle_request(self):
-        pass
+        self.status = None
+        self.response_headers = []
+        self.headers_sent = False
+        self.chunked = False
+
+        environ = self.get_environ()
+        self.body_chunks = []
+        future = self.server.loop.run_in_executor(
+            self.server.executor, self.run_application, environ)
+        future.add_done_callback(self.application_done)
+
+    def run_application(self, environ):
+        result = self.server.get_app()(environ, self.start_response)
+        self.finish_response(result)
 
     def finish_response(self, result):
-        pass
+        # runs in a worker thread, every write is handed over to the loop
+        # and waits for it, so a slow client slows the application down
+        # instead of growing the output buffer
+        try:
+            file_range = result.file_range() if isinstance(result, FileWrapper) else None
+            if file_range is not None:
+                self.call_in_loop(self.send_file_wrapper(result, *file_range))
+                result = None
+                return
+            if isinstance(result, (list, tuple)) and len(result) == 1:
+                self.set_content_length(len(result[0]))
+            for data in result:
+                if data:
+                    self.write(data)
+            if not self.headers_sent:
+                self.write(b"")
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    def call_in_loop(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.server.loop).result()
+
+    def write(self, data):
+        if self.status is None:
+            raise AssertionError("write() before start_response()")
+        self.call_in_loop(self.write_output(data))
+
+    def set_content_length(self, length):
+        if not any(name.lower() == "content-length" for name, _ in self.response_headers):
+            self.response_headers.append(("Content-Length", str(length)))
+
+    def send_wsgi_headers(self):
+        code, _, message = self.status.partition(" ")
+        if not any(name.lower() == "content-length" for name, _ in self.response_headers):
+            if self.protocol == "HTTP/1.1":
+                self.chunked = True
+            else:
+                self.close_connection = True
+        self.send_response(int(code), message)
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        for name, value in self.response_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.headers_sent = True
+
+    async def write_output(self, data):
+        if not self.connected:
+            raise ConnectionResetError("client disconnected")
+        if not self.headers_sent:
+            self.send_wsgi_headers()
+        if data and self.method != "HEAD":
+            if self.chunked:
+                self.push(b"%x\r\n" % len(data) + data + b"\r\n")
+            else:
+                self.push(data)
+        await self.can_write.wait()
+
+    async def send_file_wrapper(self, result, offset, count):
+        for name, value in self.response_headers:
+            if name.lower() == "content-length":
+                count = min(count, int(value))
+        self.set_content_length(count)
+        self.send_wsgi_headers()
+        if self.method == "HEAD":
+            result.close()
+            return
+        self.push_with_producer(httpd.SendfileProducer(
+            result.filelike, offset=offset, count=count, release=result.close))
+
+    def application_done(self, future):
+        self.busy = False
+        exc = future.exception()
+        if exc is not None:
+            log.error("Error in WSGI application", exc_info=exc)
+            if not self.connected:
+                return
+            if self.headers_sent:
+                self.close()
+                return
+            self.close_connection = True
+            self.send_error(500)
+            return
+
+        if not self.connected:
+            return
+        if self.chunked and self.method != "HEAD":
+            self.push(b"0\r\n\r\n")
+        self.response_complete()
+        self.process_requests()
+
+
 def application(env, start_response):
     start_response('200 OK', [('Content-Type', 'text/plain')])
-    return [b'Hello World']
\ No newline at end of file
+    return [b'Hello World']
+
+
+def parse_args():
+    parser = httpd.app_arg_parser("Asynchronous WSGI server", "async_wsgi:application")
+    parser.add_argument("--threads", dest="threads", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    httpd.run_app_server(args, AsyncWSGIServer, threads=args.threads)
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import benchutil
+
+
+MESSAGE = b"x" * 64
+
+
+async def client(port, deadline, latencies, served):
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection("127.0.0.1", port), timeout=deadline - time.monotonic())
+    except (OSError, asyncio.TimeoutError):
+        return
+
+    answered = False
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            writer.write(MESSAGE)
+            await asyncio.wait_for(reader.readexactly(len(MESSAGE)),
+                                   timeout=max(deadline - time.monotonic(), 0.001))
+            latencies.append(time.perf_counter() - started)
+            answered = True
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        served.append(answered)
+        writer.close()
+
+
+async def run_load(port, connections, duration):
+    latencies = []
+    served = []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(client(port, deadline, latencies, served) for _ in range(connections)))
+    return latencies, sum(served)
+
+
+def percentile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)] if values else float("nan")
+
+
+def bench(mode, processes, connections, duration):
+    # every run gets its own port and process group, so a server that
+    # failed to start is noticed and no worker outlives its run
+    port = benchutil.free_port()
+    env = dict(os.environ, TRACE_RATE="1")
+    command = [sys.executable, "multi_process.py", "--mode", mode, "--host", "127.0.0.1", "-w", str(processes)]
+    try:
+        with benchutil.running_server(command, port, env=env):
+            latencies, served = asyncio.run(run_load(port, connections, duration))
+    except RuntimeError as e:
+        sys.exit(f"{mode}: {e}")
+
+    latencies.sort()
+    print(f"{mode:>8} {connections:>6} {served:>7} {len(latencies) / duration:>10.0f} "
+          f"{percentile(latencies, 0.5) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Thread-per-connection vs event loop per process")
+    parser.add_argument("-w", dest="processes", type=int, default=os.cpu_count())
+    parser.add_argument("-c", dest="connections", type=int, nargs="+", default=[8, 64, 256])
+    parser.add_argument("-d", dest="duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'conns':>6} {'served':>7} {'echo/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for connections in args.connections:
+        for mode in ("threads", "loop"):
+            bench(mode, args.processes, connections, args.duration)
@@ -0,0 +1,74 @@
+import timeit
+
+from httpd import HTTPRequestParser
+
+
+REQUEST = (
+    b"GET /dir1/bootstrap.css?v=3 HTTP/1.1\r\n"
+    b"Host: localhost:9000\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n"
+    b"Accept: text/css,*/*;q=0.1\r\n"
+    b"Accept-Language: en-US,en;q=0.5\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Referer: http://localhost:9000/dir1/page.html\r\n"
+    b"\r\n"
+)
+
+
+def legacy_parse_headers(collected_data):
+    # the parser httpd.py used before HTTPRequestParser
+    headers = {}
+    data = "".join(list(map(str, collected_data))).split("\\r\\n")
+
+    try:
+        headers["method"] = data[0].split()[0][2:]
+        headers["uri"] = data[0].split()[1]
+        headers["protocol"] = data[0].split()[2]
+
+        for key, value in list(map(lambda x: x.split(':', maxsplit=1), data[1:])):
+            headers[str(key)] = value
+
+        return headers
+
+    except:
+        pass
+
+
+def parse_legacy():
+    legacy_parse_headers([REQUEST[:-4]])
+
+
+def parse_incremental():
+    parser = HTTPRequestParser()
+    parser.feed(REQUEST)
+    parser.parse()
+
+
+def parse_incremental_chunks(chunks=[REQUEST[i:i + 64] for i in range(0, len(REQUEST), 64)]):
+    parser = HTTPRequestParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        parser.parse()
+
+
+def parse_pipelined(parser=HTTPRequestParser(), batch=REQUEST * 10):
+    parser.feed(batch)
+    while parser.parse() is not None:
+        pass
+
+
+def main(number: int = 100000) -> None:
+    benchmarks = [
+        ("legacy repr-based parser", parse_legacy, 1),
+        ("incremental parser", parse_incremental, 1),
+        ("incremental parser, 64 byte reads", parse_incremental_chunks, 1),
+        ("incremental parser, 10 pipelined", parse_pipelined, 10),
+    ]
+    for name, func, requests in benchmarks:
+        elapsed = min(timeit.repeat(func, number=number // requests, repeat=3))
+        print(f"{name:36} {number / elapsed:12,.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
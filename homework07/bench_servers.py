@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import sys
+import time
+
+import benchutil
+
+
+# name: (protocol, path, command line without --port)
+VARIANTS = {
+    "web_singlethread": ("http", "/", ["web_singlethread.py", "--host", "127.0.0.1"]),
+    "web_multithread": ("http", "/", ["web_multithread.py", "--host", "127.0.0.1"]),
+    "web_multithread_pool": ("http", "/", ["web_multithread.py", "--host", "127.0.0.1", "--workers", "32"]),
+    "web_asyncio": ("http", "/", ["web_asyncio.py"]),
+    "httpd": ("http", "/index.html", ["httpd.py", "-r", "test_www", "--log", "warning"]),
+    "httpd_w2": ("http", "/index.html", ["httpd.py", "-r", "test_www", "--log", "warning", "-w", "2"]),
+    "async_wsgi": ("http", "/", ["async_wsgi.py", "--log", "warning"]),
+    "async_asgi": ("http", "/", ["async_asgi.py", "--log", "warning"]),
+    "tcp_singlethread": ("echo", None, ["tcp_singlethread.py", "--host", "127.0.0.1"]),
+    "tcp_multithread": ("echo", None, ["tcp_multithread.py", "--host", "127.0.0.1"]),
+    "tcp_multithread_pool": ("echo", None, ["tcp_multithread.py", "--host", "127.0.0.1", "--workers", "32"]),
+    "select_module": ("echo", None, ["select_module.py", "--host", "127.0.0.1"]),
+    "tcp_asyncio": ("echo", None, ["tcp_asyncio.py", "--host", "127.0.0.1", "--log", "warning"]),
+    "multi_process": ("echo", None, ["multi_process.py", "--host", "127.0.0.1", "-w", "2"]),
+    "multi_process_loop": ("echo", None, ["multi_process.py", "--host", "127.0.0.1", "-w", "2", "--mode", "loop"]),
+}
+
+FIELDS = ["variant", "load", "concurrency", "rate", "duration", "requests", "errors",
+          "error_rate", "throughput", "p50_ms", "p99_ms", "p999_ms", "max_ms"]
+
+ECHO_MESSAGE = b"x" * 64
+
+
+async def http_request(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n".encode())
+        response = await reader.read()
+    finally:
+        writer.close()
+    status = response.split(b" ", 2)[1:2]
+    if status != [b"200"]:
+        raise ValueError(f"unexpected response {response[:32]!r}")
+
+
+async def echo_request(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(ECHO_MESSAGE)
+        data = await reader.readexactly(len(ECHO_MESSAGE))
+    finally:
+        writer.close()
+    if data != ECHO_MESSAGE:
+        raise ValueError(f"unexpected echo {data[:32]!r}")
+
+
+class Recorder:
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = []
+        self.errors = 0
+
+    async def call(self, request, port, path, timeout, scheduled=None):
+        # open-loop latency counts from the moment the request was due,
+        # so a server that falls behind is not measured at its own pace
+        started = time.perf_counter() if scheduled is None else scheduled
+        try:
+            await asyncio.wait_for(request(port, path), timeout)
+            ok = True
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            ok = False
+        if started < self.measure_from:
+            return
+        if ok:
+            self.latencies.append(time.perf_counter() - started)
+        else:
+            self.errors += 1
+
+
+async def closed_loop(request, port, path, concurrency, duration, warmup, timeout):
+    # a fixed number of clients, each sends its next request as soon as
+    # the previous one is answered
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+    recorder = Recorder(measure_from)
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await recorder.call(request, port, path, timeout)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return recorder
+
+
+async def open_loop(request, port, path, rate, duration, warmup, timeout):
+    # requests arrive at a constant rate however long the answers take
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+    recorder = Recorder(measure_from)
+    tasks = set()
+    interval = 1.0 / rate
+    scheduled = time.perf_counter()
+    while scheduled < deadline:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(recorder.call(request, port, path, timeout, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        scheduled += interval
+    if tasks:
+        await asyncio.wait(tasks)
+    return recorder
+
+
+def percentile_ms(values, q):
+    # no answers at all is reported as null rather than NaN, which
+    # strict JSON readers refuse
+    if not values:
+        return None
+    return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+
+
+def summarize(name, load, recorder, args):
+    latencies = sorted(recorder.latencies)
+    total = len(latencies) + recorder.errors
+    return {
+        "variant": name,
+        "load": load,
+        "concurrency": args.concurrency if load == "closed" else None,
+        "rate": args.rate if load == "open" else None,
+        "duration": args.duration,
+        "requests": len(latencies),
+        "errors": recorder.errors,
+        "error_rate": round(recorder.errors / total, 4) if total else 0.0,
+        "throughput": round(len(latencies) / args.duration, 1),
+        "p50_ms": percentile_ms(latencies, 0.5),
+        "p99_ms": percentile_ms(latencies, 0.99),
+        "p999_ms": percentile_ms(latencies, 0.999),
+        "max_ms": percentile_ms(latencies, 1.0),
+    }
+
+
+def bench(name, load, args):
+    protocol, path, command = VARIANTS[name]
+    request = http_request if protocol == "http" else echo_request
+    port = benchutil.free_port()
+    # the echo servers trace every message, a rate limit keeps the
+    # logging out of the measurement
+    env = dict(os.environ, TRACE_RATE="1")
+    with benchutil.running_server([sys.executable] + command, port, env=env):
+        if load == "closed":
+            recorder = asyncio.run(closed_loop(request, port, path, args.concurrency,
+                                               args.duration, args.warmup, args.timeout))
+        else:
+            recorder = asyncio.run(open_loop(request, port, path, args.rate,
+                                             args.duration, args.warmup, args.timeout))
+    return summarize(name, load, recorder, args)
+
+
+def print_row(row):
+    latencies = " ".join("{:>9}".format("-" if row[key] is None else f"{row[key]:.2f}")
+                         for key in ("p50_ms", "p99_ms", "p999_ms"))
+    print(f"{row['variant']:>22} {row['load']:>6} {row['requests']:>8} {row['error_rate']:>7.2%} "
+          f"{row['throughput']:>9.1f} {latencies}", flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Load test for the homework07 servers")
+    parser.add_argument("variants", nargs="*", metavar="variant",
+                        help=f"one of {', '.join(VARIANTS)}; all of them by default")
+    parser.add_argument("--load", dest="load", choices=("closed", "open", "both"), default="both")
+    parser.add_argument("-c", dest="concurrency", type=int, default=32,
+                        help="clients of the closed-loop generator")
+    parser.add_argument("-r", dest="rate", type=float, default=200.0,
+                        help="requests per second of the open-loop generator")
+    parser.add_argument("-d", dest="duration", type=float, default=5.0)
+    parser.add_argument("--warmup", dest="warmup", type=float, default=1.0)
+    parser.add_argument("--timeout", dest="timeout", type=float, default=5.0)
+    parser.add_argument("--json", dest="json", default=None)
+    parser.add_argument("--csv", dest="csv", default=None)
+    args = parser.parse_args()
+    for name in args.variants:
+        if name not in VARIANTS:
+            parser.error(f"unknown variant {name!r}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    loads = ("closed", "open") if args.load == "both" else (args.load,)
+
+    print(f"{'variant':>22} {'load':>6} {'requests':>8} {'errors':>7} "
+          f"{'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9}")
+    results = []
+    for name in args.variants or VARIANTS:
+        for load in loads:
+            try:
+                row = bench(name, load, args)
+            except RuntimeError as e:
+                print(f"{name:>22} {load:>6} failed: {e}", flush=True)
+                continue
+            print_row(row)
+            results.append(row)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "results": results,
+            }, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
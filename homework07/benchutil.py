@@ -0,0 +1,58 @@
+import contextlib
+import os
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def stop_server(server):
+    # the pre-forked variants leave workers behind when only the parent
+    # is signalled, every server runs in its own session so the whole
+    # group can be stopped, even after the parent is gone
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(server.pid, sig)
+        except ProcessLookupError:
+            break
+        try:
+            server.wait(5.0)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+
+
+@contextlib.contextmanager
+def running_server(command, port, env=None, timeout=10.0):
+    # yields once the server accepts connections on port and stops it on
+    # exit; a server that dies or never listens raises RuntimeError with
+    # what it wrote to stderr
+    with tempfile.TemporaryFile() as errors:
+        server = subprocess.Popen(command + ["--port", str(port)], cwd=HERE, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=errors, start_new_session=True)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                if server.poll() is not None:
+                    errors.seek(0)
+                    raise RuntimeError(f"server exited with code {server.returncode}: "
+                                       f"{errors.read().decode(errors='replace').strip()}")
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"server did not start listening on port {port}")
+                    time.sleep(0.1)
+            yield server
+        finally:
+            stop_server(server)
@@ -1,17 +1,45 @@
-import asyncore
-import asynchat
+import asyncio
 import socket
 import multiprocessing
+import multiprocessing.connection
+import signal
 import logging
 import mimetypes
 import os
-import urllib3
+import urllib.parse
 import argparse
-from time import strftime, gmtime
+import collections
+import email.utils
+import gzip
+import html
+import importlib
+from bisect import bisect_left
+from time import strftime, gmtime, monotonic, perf_counter, sleep, time
 
-from pprint import pprint
+import accesslog
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DOCUMENT_ROOT = "."
+SERVER_NAME = "AsyncHTTPServer/0.1"
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/x-javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+log = logging.getLogger(__name__)
 
 def url_normalize(path):
     if path.startswith("."):
@@ -29,104 +57,1029 @@ def url_normalize(path):
 
 
 class FileProducer(object):
+    # reads the file into memory chunk by chunk, the fallback for
+    # transfers that cannot use sendfile; reads go to an explicit offset
+    # because cached descriptors are shared between connections
 
-    def __init__(self, file, chunk_size=4096):
+    def __init__(self, file, offset=0, count=None, chunk_size=4096, release=None):
         self.file = file
+        self.release = release
+        self.offset = offset
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self.remaining = count
         self.chunk_size = chunk_size
 
     def more(self):
-        if self.file:
-            data = self.file.read(self.chunk_size)
+        if self.file and self.remaining > 0:
+            self.file.seek(self.offset)
+            data = self.file.read(min(self.chunk_size, self.remaining))
             if data:
+                self.offset += len(data)
+                self.remaining -= len(data)
                 return data
-            self.file.close()
-            self.file = None
+        self.close()
         return ""
 
+    def close(self):
+        if self.file:
+            if self.release is not None:
+                self.release()
+            else:
+                self.file.close()
+            self.file = None
 
-class AsyncServer(asyncore.dispatcher):
+    def done(self):
+        return self.file is None
 
-    def __init__(self, host="127.0.0.1", port=9000):
-        super().__init__()
-        self.create_socket()
-        self.set_reuse_addr()
-        self.bind((host, port))
-        self.listen(5)
 
-    def handle_accepted(self, sock, addr):
-        print(f"Incoming connection from {addr}")
-        AsyncHTTPRequestHandler(sock)
+class SendfileProducer(FileProducer):
+    # initiate_send hands the file to loop.sendfile, it is only read
+    # through FileProducer.more() when sendfile is not available
+
+    pass
+
+
+class FileCacheEntry(object):
+
+    def __init__(self, path, file, stat, ctype):
+        self.path = path
+        self.file = file
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.ino = stat.st_ino
+        self.ctype = ctype
+        self.etag = f'"{self.ino:x}-{self.size:x}-{stat.st_mtime_ns:x}"'
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.validators = f"ETag: {self.etag}\r\nLast-Modified: {self.last_modified}\r\n".encode()
+        self.headers = (f"Content-Type: {ctype}\r\nContent-Length: {self.size}\r\n"
+                        f"Accept-Ranges: bytes\r\n").encode() + self.validators
+        self.checked = monotonic()
+        self.refs = 0
+        self.evicted = False
+        self.missing_siblings = {}
+
+    def acquire(self):
+        self.refs += 1
+        return self.file
+
+    def release(self):
+        self.refs -= 1
+        if self.evicted and self.refs == 0:
+            self.file.close()
+
+    def evict(self):
+        self.evicted = True
+        if self.refs == 0:
+            self.file.close()
+
+    def is_stale(self, stat):
+        return (stat.st_mtime, stat.st_size, stat.st_ino) != (self.mtime, self.size, self.ino)
+
+
+class FileCache(object):
+
+    def __init__(self, maxsize=128, ttl=2.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        now = monotonic()
+        if now - entry.checked > self.ttl:
+            try:
+                stale = entry.is_stale(os.stat(entry.path))
+            except OSError:
+                stale = True
+            if stale:
+                self.pop(key)
+                return None
+            entry.checked = now
+
+        self.entries.move_to_end(key)
+        return entry
+
+    def open(self, key, path, ctype):
+        file = open(path, "rb")
+        stat = os.fstat(file.fileno())
+        entry = FileCacheEntry(path, file, stat, ctype)
+        if self.maxsize <= 0:
+            entry.evicted = True
+            return entry
+
+        self.pop(key)
+        self.entries[key] = entry
+        while len(self.entries) > self.maxsize:
+            _, oldest = self.entries.popitem(last=False)
+            oldest.evict()
+        return entry
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry.evict()
+
+    def clear(self):
+        for key in list(self.entries):
+            self.pop(key)
+
+
+class ResponseCache(object):
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, threshold=16 * 1024):
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def accepts(self, source):
+        return source.size <= self.threshold
+
+    def get(self, source):
+        item = self.entries.get(source.path)
+        if item is None or item[0] is not source:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(source.path)
+        return item[1]
+
+    def put(self, source, headers, body):
+        response = headers + body
+        self.pop(source.path)
+        if len(response) > self.max_bytes:
+            return response
+
+        self.entries[source.path] = (source, response)
+        self.size += len(response)
+        while self.size > self.max_bytes:
+            _, (_, oldest) = self.entries.popitem(last=False)
+            self.size -= len(oldest)
+        return response
+
+    def pop(self, key):
+        item = self.entries.pop(key, None)
+        if item is not None:
+            self.size -= len(item[1])
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+
+class DirectoryIndex(object):
+    # rendered listings are reused while the mtime of the directory is
+    # unchanged, which covers entries being added, removed or renamed
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+
+    def get(self, url_path, path):
+        stat = os.stat(path)
+        item = self.entries.get(url_path)
+        if item is not None and item[0] == stat.st_mtime_ns:
+            self.entries.move_to_end(url_path)
+            return item[1]
+
+        body = render_index(url_path, path)
+        # a directory changed within the mtime granularity could change
+        # again without a new mtime, so it is not cached yet
+        if self.maxsize > 0 and time() - stat.st_mtime >= 1.0:
+            self.entries[url_path] = (stat.st_mtime_ns, body)
+            self.entries.move_to_end(url_path)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return body
+
+
+def render_index(url_path, path):
+    names = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            names.append(entry.name + "/" if entry.is_dir() else entry.name)
+    names.sort()
+    if url_path != "/":
+        names.insert(0, "../")
+
+    title = html.escape(f"Index of {url_path}")
+    links = "".join(
+        f'<li><a href="{urllib.parse.quote(os.fsencode(name))}">{html.escape(name)}</a></li>\n'
+        for name in names)
+    page = (f"<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>{title}</title></head>\n"
+            f"<body>\n<h1>{title}</h1>\n<ul>\n{links}</ul>\n</body>\n</html>\n")
+    return page.encode("utf-8", "replace")
+
+
+def is_compressible(ctype):
+    return ctype.startswith("text/") or ctype in COMPRESSIBLE_TYPES
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def compress_file(fd, size, encoding):
+    return compress(os.pread(fd, size, 0), encoding)
+
+
+class CompressionCache(object):
+    # a miss is answered with the identity encoding while the file is
+    # compressed in the executor of the loop, later requests get the result
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, min_size=256, max_size=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.pending = set()
+        self.size = 0
+
+    def get(self, source, encoding):
+        if encoding == "br" and brotli is None:
+            return None
+        if not self.min_size <= source.size <= self.max_size:
+            return None
+
+        key = (source.path, source.etag, encoding)
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+            return data or None
+
+        if key not in self.pending:
+            self.pending.add(key)
+            file = source.acquire()
+            future = asyncio.get_running_loop().run_in_executor(
+                None, compress_file, file.fileno(), source.size, encoding)
+            future.add_done_callback(lambda future: self.store(key, source, future))
+        return None
+
+    def store(self, key, source, future):
+        source.release()
+        self.pending.discard(key)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            log.error("Cannot compress %s: %s", source.path, future.exception())
+            return
+
+        data = future.result()
+        if len(data) >= source.size:
+            # not worth it, remember that with an empty entry
+            data = b""
+        if len(data) <= self.max_bytes:
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, oldest = self.entries.popitem(last=False)
+                self.size -= len(oldest)
+
+
+class LatencyHistogram(object):
+    # log-linear buckets like HdrHistogram, two per power of two from
+    # about 8us to 64s, so recording is a single bisect
+    bounds = [2.0 ** (exp / 2) for exp in range(-34, 13)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.started = time()
+        self.requests = {}
+        self.connections_open = 0
+        self.connections_total = 0
+        self.connections_rejected = 0
+        self.bytes_sent = 0
+
+    def observe(self, code, route, elapsed):
+        histogram = self.requests.get((code, route))
+        if histogram is None:
+            histogram = self.requests[code, route] = LatencyHistogram()
+        histogram.observe(elapsed)
+
+    def connection_opened(self):
+        self.connections_open += 1
+        self.connections_total += 1
+
+    def connection_closed(self, bytes_sent):
+        self.connections_open -= 1
+        self.bytes_sent += bytes_sent
+
+    def render(self, connections=(), response_cache=None):
+        # every pre-forked worker counts on its own and a scrape reaches
+        # whichever worker accepts it, so each series carries the pid
+        worker = f'worker="{os.getpid()}"'
+        lines = [
+            "# HELP httpd_request_duration_seconds Time from parsing a request to queueing its response.",
+            "# TYPE httpd_request_duration_seconds histogram",
+        ]
+        for (code, route), histogram in sorted(self.requests.items()):
+            labels = f'{worker},code="{code}",route="{escape_label(route)}"'
+            total = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                total += count
+                lines.append(f'httpd_request_duration_seconds_bucket{{{labels},le="{bound:.6g}"}} {total}')
+            total += histogram.counts[-1]
+            lines.append(f'httpd_request_duration_seconds_bucket{{{labels},le="+Inf"}} {total}')
+            lines.append(f"httpd_request_duration_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"httpd_request_duration_seconds_count{{{labels}}} {total}")
+
+        bytes_sent = self.bytes_sent + sum(handler.bytes_sent for handler in connections)
+        lines += [
+            "# HELP httpd_sent_bytes_total Bytes written to clients.",
+            "# TYPE httpd_sent_bytes_total counter",
+            f"httpd_sent_bytes_total{{{worker}}} {bytes_sent}",
+            "# HELP httpd_connections_total Accepted connections.",
+            "# TYPE httpd_connections_total counter",
+            f"httpd_connections_total{{{worker}}} {self.connections_total}",
+            "# HELP httpd_connections_open Currently open connections.",
+            "# TYPE httpd_connections_open gauge",
+            f"httpd_connections_open{{{worker}}} {self.connections_open}",
+            "# HELP httpd_connections_rejected_total Connections answered with 503 over the connection limit.",
+            "# TYPE httpd_connections_rejected_total counter",
+            f"httpd_connections_rejected_total{{{worker}}} {self.connections_rejected}",
+            "# HELP process_start_time_seconds Start time of the process since the epoch.",
+            "# TYPE process_start_time_seconds gauge",
+            f"process_start_time_seconds{{{worker}}} {self.started:.3f}",
+        ]
+        if response_cache is not None:
+            stats = response_cache.stats()
+            lines += [
+                "# HELP httpd_response_cache_hits_total Responses served from the response cache.",
+                "# TYPE httpd_response_cache_hits_total counter",
+                f"httpd_response_cache_hits_total{{{worker}}} {stats['hits']}",
+                "# HELP httpd_response_cache_misses_total Cacheable responses that had to be built.",
+                "# TYPE httpd_response_cache_misses_total counter",
+                f"httpd_response_cache_misses_total{{{worker}}} {stats['misses']}",
+                "# HELP httpd_response_cache_entries Responses held in the response cache.",
+                "# TYPE httpd_response_cache_entries gauge",
+                f"httpd_response_cache_entries{{{worker}}} {stats['entries']}",
+                "# HELP httpd_response_cache_bytes Bytes held in the response cache.",
+                "# TYPE httpd_response_cache_bytes gauge",
+                f"httpd_response_cache_bytes{{{worker}}} {stats['bytes']}",
+                "# HELP httpd_response_cache_threshold_bytes Largest file whose response is cached.",
+                "# TYPE httpd_response_cache_threshold_bytes gauge",
+                f"httpd_response_cache_threshold_bytes{{{worker}}} {response_cache.threshold}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class HTTPParseError(Exception):
+
+    def __init__(self, code, message=None):
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+HTTPRequest = collections.namedtuple("HTTPRequest", "method uri protocol headers")
+
+
+class HTTPRequestParser(object):
+
+    def __init__(self, max_header_size=8192, max_headers=100):
+        self.max_header_size = max_header_size
+        self.max_headers = max_headers
+        self.buffer = bytearray()
+        self.scan_pos = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def parse(self):
+        buffer = self.buffer
+
+        # empty lines in front of a request are ignored (RFC 7230, 3.5)
+        start = 0
+        while buffer.startswith(b"\r\n", start):
+            start += 2
+        if start:
+            del buffer[:start]
+            self.scan_pos = max(0, self.scan_pos - start)
+
+        # only the bytes received since the last call are scanned again
+        end = buffer.find(b"\r\n\r\n", self.scan_pos)
+        if end == -1:
+            if len(buffer) > self.max_header_size:
+                raise HTTPParseError(431)
+            self.scan_pos = max(0, len(buffer) - 3)
+            return None
+        if end > self.max_header_size:
+            raise HTTPParseError(431)
+
+        view = memoryview(buffer)
+        try:
+            request = self.parse_block(view, end)
+        finally:
+            view.release()
+        del buffer[:end + 4]
+        self.scan_pos = 0
+        return request
+
+    def parse_block(self, view, end):
+        # the header block is decoded once, straight from the buffer
+        lines = str(view[:end], "latin-1").split("\r\n")
+        if len(lines) - 1 > self.max_headers:
+            raise HTTPParseError(431)
+
+        request_line = lines[0].split()
+        if len(request_line) != 3 or not request_line[2].startswith("HTTP/"):
+            raise HTTPParseError(400)
+
+        # names are lower-cased once here, a field sent more than once is
+        # combined into one comma separated value (RFC 7230, 3.2.2)
+        headers = {}
+        for line in lines[1:]:
+            key, sep, value = line.partition(":")
+            if not sep:
+                raise HTTPParseError(400)
+            key = key.strip().lower()
+            value = value.strip()
+            if key in headers:
+                headers[key] += ", " + value
+            else:
+                headers[key] = value
+        return HTTPRequest(request_line[0], request_line[1], request_line[2], headers)
+
+
+class AsyncChat(asyncio.Protocol):
+    # the subset of asynchat.async_chat used by the request handlers,
+    # implemented on top of an asyncio transport
+
+    use_sendfile = hasattr(os, "sendfile")
+    sendfile_chunk_size = 1024 * 1024
+    write_buffer_size = 64 * 1024
+
+    def __init__(self):
+        self.producer_fifo = collections.deque()
+        self.transport = None
+        self.addr = None
+        self.connected = False
+        self.writing_paused = False
+        self.sending_file = None
+        self.sendfile_progress_at = None
+        self.bytes_sent = 0
+        self.bytes_queued = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info("peername")
+        self.connected = True
+        transport.set_write_buffer_limits(self.write_buffer_size, self.write_buffer_size // 4)
+
+    def connection_lost(self, exc):
+        self.connected = False
+        self.discard_buffers()
+
+    def eof_received(self):
+        # the client will not send more requests, but the responses
+        # already queued for it are still written before closing
+        self.close_when_done()
+        return True
+
+    def push(self, data):
+        if data:
+            self.bytes_queued += len(data)
+            self.producer_fifo.append(data)
+        self.initiate_send()
+
+    def push_with_producer(self, producer):
+        self.bytes_queued += getattr(producer, "remaining", 0)
+        self.producer_fifo.append(producer)
+        self.initiate_send()
+
+    def close_when_done(self):
+        self.producer_fifo.append(None)
+        self.initiate_send()
+
+    def initiate_send(self):
+        while self.producer_fifo and self.connected:
+            if self.writing_paused or self.sending_file is not None:
+                return
+
+            first = self.producer_fifo[0]
+            if first is None:
+                self.producer_fifo.popleft()
+                self.handle_close()
+                return
+
+            if isinstance(first, (bytes, bytearray, memoryview)):
+                self.producer_fifo.popleft()
+                self.bytes_sent += len(first)
+                self.transport.write(first)
+                continue
+
+            if isinstance(first, SendfileProducer) and self.use_sendfile:
+                self.sending_file = asyncio.ensure_future(self.sendfile(first))
+                return
+
+            data = first.more()
+            if data:
+                self.bytes_sent += len(data)
+                self.transport.write(data)
+            else:
+                self.producer_fifo.popleft()
+
+    async def sendfile(self, producer):
+        loop = asyncio.get_running_loop()
+        self.sendfile_progress_at = monotonic()
+        try:
+            # sent in slices so that a stalled client can be told apart
+            # from a large file that is still being transferred
+            while producer.remaining > 0:
+                sent = await loop.sendfile(self.transport, producer.file, producer.offset,
+                                           min(producer.remaining, self.sendfile_chunk_size),
+                                           fallback=False)
+                if not sent:
+                    break
+                producer.offset += sent
+                producer.remaining -= sent
+                self.bytes_sent += sent
+                self.sendfile_progress_at = monotonic()
+            producer.close()
+        except (asyncio.SendfileNotAvailableError, NotImplementedError):
+            # the transport cannot sendfile, or the loop does not implement
+            # it at all (uvloop), the producer streams the rest through
+            # more() instead
+            self.use_sendfile = False
+        except (ConnectionError, OSError):
+            producer.close()
+            self.close()
+        finally:
+            self.sending_file = None
+
+        if producer.done() and self.producer_fifo and self.producer_fifo[0] is producer:
+            self.producer_fifo.popleft()
+        self.initiate_send()
+
+    def pause_writing(self):
+        # a client that does not read its responses is not allowed to send
+        # more requests either, so the output queue stays bounded
+        self.writing_paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.connected:
+            self.transport.resume_reading()
+        self.initiate_send()
+
+    def discard_buffers(self):
+        for producer in self.producer_fifo:
+            if isinstance(producer, FileProducer):
+                producer.close()
+        self.producer_fifo.clear()
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        self.connected = False
+        if self.transport is not None:
+            self.transport.close()
+
+
+def new_event_loop(use_uvloop=False):
+    if use_uvloop:
+        if uvloop is not None:
+            return uvloop.new_event_loop()
+        log.warning("uvloop is not installed, falling back to the asyncio event loop")
+    return asyncio.new_event_loop()
+
+
+class AsyncServer(object):
+
+    def __init__(self, host="127.0.0.1", port=9000, reuse_port=False, use_uvloop=False,
+                 backlog=1024, max_connections=0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind((host, port))
+        # the selector event loop also accepts up to backlog connections
+        # per readiness event, so this sets the accept batch as well
+        self.backlog = backlog
+        self.socket.listen(self.backlog)
+        self.socket.setblocking(False)
+        self.use_uvloop = use_uvloop
+        self.max_connections = max_connections
+        self.handler_class = AsyncHTTPRequestHandler
+        self.connections = set()
+        self.loop = None
+        self.server = None
+        self.stopping = False
+
+    def handle_accepted(self, handler, addr):
+        log.debug("Incoming connection from %s", addr)
+        self.connections.add(handler)
+
+    def overloaded(self):
+        return 0 < self.max_connections <= len(self.connections)
+
+    def handle_closed(self, handler):
+        self.connections.discard(handler)
+        if self.stopping and not self.connections:
+            self.loop.stop()
+
+    def stop(self, signum=None, frame=None):
+        # may be called from a signal handler, the loop is woken up through
+        # call_soon_threadsafe and drains open connections before stopping
+        self.stopping = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.shutdown)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.close()
+        if not self.connections:
+            self.loop.stop()
+
+    async def startup(self):
+        pass
+
+    async def cleanup(self):
+        pass
+
+    def serve_forever(self):
+        self.loop = new_event_loop(self.use_uvloop)
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.startup())
+            self.server = self.loop.run_until_complete(self.loop.create_server(
+                lambda: self.handler_class(self), sock=self.socket, backlog=self.backlog))
+            if not self.stopping:
+                self.loop.run_forever()
+        finally:
+            if self.server is not None:
+                self.server.close()
+            try:
+                self.loop.run_until_complete(self.cleanup())
+            finally:
+                self.loop.close()
+                self.loop = None
+
+    def close(self):
+        self.socket.close()
+
+
+class PreforkServer(object):
+
+    def __init__(self, nworkers, host="127.0.0.1", port=9000, reuse_port=False,
+                 use_uvloop=False, shutdown_timeout=30.0, backlog=1024, max_connections=0):
+        self.nworkers = nworkers
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.use_uvloop = use_uvloop
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.shutdown_timeout = shutdown_timeout
+        self.workers = {}
+        self.started = {}
+        self.stopping = False
+        self.stop_deadline = None
+        self.server = None
+        if not reuse_port:
+            self.server = AsyncServer(host=host, port=port, use_uvloop=use_uvloop,
+                                      backlog=backlog, max_connections=max_connections)
+
+    def spawn(self):
+        process = multiprocessing.Process(target=self.run_worker)
+        process.start()
+        self.workers[process.sentinel] = process
+        self.started[process.pid] = monotonic()
+        log.info("Started worker %d", process.pid)
+
+    def run_worker(self):
+        server = self.server
+        if server is None:
+            server = AsyncServer(host=self.host, port=self.port, reuse_port=True,
+                                 use_uvloop=self.use_uvloop, backlog=self.backlog,
+                                 max_connections=self.max_connections)
+        # the counters inherited from the master describe no requests,
+        # the worker reports its own from its own start time
+        AsyncHTTPRequestHandler.metrics = Metrics()
+        signal.signal(signal.SIGTERM, server.stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        server.serve_forever()
+        log.info("Response cache: %s", AsyncHTTPRequestHandler.response_cache.stats())
+        # the worker exits without running atexit handlers, buffered log
+        # lines are written out here
+        if AsyncHTTPRequestHandler.access_log is not None:
+            AsyncHTTPRequestHandler.access_log.close()
+        logging.shutdown()
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
 
     def serve_forever(self):
-        asyncore.loop()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.nworkers):
+            self.spawn()
+
+        while self.workers:
+            ready = multiprocessing.connection.wait(list(self.workers), timeout=1.0)
+            for sentinel in ready:
+                process = self.workers.pop(sentinel)
+                process.join()
+                uptime = monotonic() - self.started.pop(process.pid)
+                if not self.stopping:
+                    log.warning("Worker %d exited with code %s, restarting", process.pid, process.exitcode)
+                    if uptime < 1.0:
+                        # do not turn a worker that crashes on startup into a fork loop
+                        sleep(1.0)
+                    self.spawn()
 
+            if self.stopping and self.stop_deadline is None:
+                log.info("Shutting down workers")
+                self.stop_deadline = monotonic() + self.shutdown_timeout
+                for process in self.workers.values():
+                    process.terminate()
+            elif self.stop_deadline is not None and monotonic() > self.stop_deadline:
+                for process in self.workers.values():
+                    process.kill()
 
-class AsyncHTTPRequestHandler(asynchat.async_chat):
+        if self.server is not None:
+            self.server.close()
 
-    def __init__(self, sock):
-        super().__init__(sock)
-        self.sock = sock
-        self.collected_data = []
-        self.parse_header = False
 
-        self.set_terminator(b"\r\n\r\n")
+class AsyncHTTPRequestHandler(AsyncChat):
 
-    def collect_incoming_data(self, data):
-        self.collected_data.append(data)
+    file_cache = FileCache()
+    response_cache = ResponseCache()
+    compression_cache = CompressionCache()
+    compression = False
+    keep_alive_timeout = 5.0
+    read_timeout = 10.0
+    write_timeout = 30.0
+    retry_after = 1
+    max_keep_alive_requests = 100
+    max_header_size = 8192
+    max_headers = 100
+    max_ranges = 16
+    consumes_body = False
+    metrics = Metrics()
+    metrics_path = "/__metrics"
+    access_log = None
+    autoindex = False
+    directory_index = DirectoryIndex()
+
+    def __init__(self, server=None):
+        super().__init__()
+        self.server = server
+        self.parser = HTTPRequestParser(self.max_header_size, self.max_headers)
+        self.output_headers = []
+        self.method = self.uri = self.protocol = None
         self.headers = {}
-        self.parse_header = False
+        self.close_connection = True
+        self.requests_handled = 0
+        self.busy = False
+        self.rejected = False
+        self.last_activity = monotonic()
+        self.request_started_at = self.last_activity
+        self.write_paused_at = None
+        self.idle_timer = None
+        self.request_start = 0.0
+        self.status_code = None
+        self.route = "-"
+        self.response_offset = 0
 
-    def found_terminator(self):
-        self.parse_request()
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        if self.server is not None and self.server.overloaded():
+            self.reject()
+            return
 
-    def parse_request(self):
-        if not self.parse_header:
-            headers = self.parse_headers()
-            self.parse_header = True
+        self.metrics.connection_opened()
+        self.idle_timer = asyncio.get_running_loop().call_later(
+            self.timer_interval(), self.check_timeouts)
+        if self.server is not None:
+            self.server.handle_accepted(self, self.addr)
 
-            pprint(headers)
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if self.rejected:
+            return
+        self.metrics.connection_closed(self.bytes_sent)
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        if self.server is not None:
+            self.server.handle_closed(self)
 
-            if headers is None:
-                self.send_error(400, "Bad Request")
+    def reject(self):
+        # over the connection limit the request is not even parsed, the
+        # client gets a 503 and a FIN, and the socket lingers briefly so
+        # that a request already in flight does not turn it into a reset
+        self.rejected = True
+        self.metrics.connections_rejected += 1
+        self.send_response(503, 'Service Unavailable')
+        self.send_header("Retry-After", self.retry_after)
+        self.send_header("Content-Length", 0)
+        self.end_headers()
+        if self.transport.can_write_eof():
+            self.transport.write_eof()
+        self.idle_timer = asyncio.get_running_loop().call_later(1.0, self.close)
 
-            self.headers = headers
+    def data_received(self, data):
+        if self.rejected:
+            return
+        self.last_activity = monotonic()
+        if not self.parser.buffer:
+            self.request_started_at = self.last_activity
+        self.parser.feed(data)
+        self.process_requests()
 
-            if headers["method"] == "POST":
-                self.send_error(403)
-            else:
-                self.handle_request()
+    def eof_received(self):
+        if self.rejected:
+            self.close()
+            return False
+        return super().eof_received()
+
+    def pause_writing(self):
+        super().pause_writing()
+        self.write_paused_at = monotonic()
+
+    def process_requests(self):
+        # pipelined requests are answered in order, anything the client
+        # sent after a response that closes the connection is dropped
+        while (self.connected and not self.busy and not self.writing_paused
+               and not (self.close_connection and self.requests_handled)):
+            self.request_start = perf_counter()
+            self.route = "-"
+            self.response_offset = self.bytes_queued
+            try:
+                request = self.parser.parse()
+            except HTTPParseError as e:
+                self.clear_request()
+                self.close_connection = True
+                self.send_error(e.code, e.message)
+                return
+            if request is None:
+                return
+            self.request_started_at = self.last_activity
+            self.parse_request(request)
+
+    def resume_writing(self):
+        self.write_paused_at = None
+        super().resume_writing()
+        self.process_requests()
+
+    def read_deadline(self):
+        # the whole request head has to arrive within read_timeout, a
+        # client trickling in header bytes is not given more time
+        if not self.busy and self.parser.buffer:
+            return self.request_started_at + self.read_timeout
+        return None
+
+    def check_timeouts(self):
+        if not self.connected:
+            return
+
+        read_deadline = self.read_deadline()
+        if self.write_paused_at is not None:
+            # the client stopped reading what is sent to it, closing would
+            # still wait for the buffered output to be flushed
+            deadline, expire = self.write_paused_at + self.write_timeout, self.abort
+        elif self.sending_file is not None:
+            deadline, expire = self.sendfile_progress_at + self.write_timeout, self.abort
+        elif read_deadline is not None:
+            deadline, expire = read_deadline, self.request_timeout
+        elif self.busy or self.producer_fifo or self.transport.get_write_buffer_size():
+            # only the wait for the next request counts as idle time, a
+            # slow download keeps the connection open while it progresses
+            deadline, expire = None, None
         else:
-            self.set_terminator(None)
-            self.handle_request()
+            deadline, expire = self.last_activity + self.keep_alive_timeout, self.close
 
-    def parse_headers(self):
-        headers = {}
-        data = "".join(list(map(str, self.collected_data))).split("\\r\\n")
+        now = monotonic()
+        if deadline is None or now < deadline:
+            delay = self.timer_interval()
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+            self.idle_timer = asyncio.get_running_loop().call_later(delay, self.check_timeouts)
+        else:
+            self.idle_timer = None
+            expire()
 
-        try:
-            headers["method"] = data[0].split()[0][2:]
-            headers["uri"] = data[0].split()[1]
-            headers["protocol"] = data[0].split()[2]
+    def timer_interval(self):
+        # no deadline can start later than it would have to be checked when
+        # the timer never sleeps longer than the shortest timeout
+        return min(self.keep_alive_timeout, self.read_timeout, self.write_timeout)
+
+    def abort(self):
+        self.connected = False
+        if self.sending_file is not None:
+            self.sending_file.cancel()
+        self.transport.abort()
+
+    def request_timeout(self):
+        if self.busy:
+            self.close()
+            return
+        self.request_start = perf_counter() - (monotonic() - self.request_started_at)
+        self.clear_request()
+        self.close_connection = True
+        self.send_error(408)
 
-            for key, value in list(map(lambda x: x.split(':', maxsplit=1), data[1:])):
-                headers[str(key)] = value
+    def clear_request(self):
+        self.method = self.uri = self.protocol = None
+        self.headers = {}
+
+    def parse_request(self, request):
+        log.debug("Request: %s", request)
 
-            return headers
+        self.method, self.uri, self.protocol, self.headers = request
+        self.close_connection = not self.should_keep_alive()
 
-        except:
-            pass
+        if self.method == "POST":
+            self.send_error(403)
+        else:
+            self.handle_request()
+
+    def get_header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def should_keep_alive(self):
+        if self.requests_handled + 1 >= self.max_keep_alive_requests:
+            return False
+        # unless the handler reads request bodies they would be parsed
+        # as the next pipelined request
+        if self.get_header("Transfer-Encoding"):
+            return False
+        if not self.consumes_body and self.get_header("Content-Length", "0") != "0":
+            return False
+
+        connection = self.get_header("Connection", "").lower()
+        if self.protocol == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    def response_complete(self):
+        self.metrics.observe(self.status_code, self.route, perf_counter() - self.request_start)
+        if self.access_log is not None:
+            # the size includes the status line and headers, like %O in Apache
+            self.access_log.log(self.addr, self.method, self.uri, self.protocol, self.headers,
+                                self.status_code, self.bytes_queued - self.response_offset)
+        self.requests_handled += 1
+        if self.close_connection:
+            self.close_when_done()
 
     def handle_request(self):
-        method_name = 'do_' + self.headers["method"]
+        if self.uri.partition("?")[0] == self.metrics_path and self.method in ("GET", "HEAD"):
+            self.send_metrics()
+            return
+
+        method_name = 'do_' + self.method
 
         if not hasattr(self, method_name):
             self.send_error(405)
-            self.handle_close()
             return
 
         handler = getattr(self, method_name)
         handler()
 
+    def send_metrics(self):
+        self.route = self.metrics_path
+        connections = self.server.connections if self.server is not None else ()
+        body = self.metrics.render(connections, self.response_cache).encode()
+        self.send_response(200, 'OK')
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        if self.method != "HEAD":
+            self.push(body)
+        self.response_complete()
+
     def send_error(self, code, message=None):
         try:
             short_msg, long_msg = self.responses[code]
@@ -135,34 +1088,372 @@ class AsyncHTTPRequestHandler(asynchat.async_chat):
         if message is None:
             message = short_msg
 
+        body = f"{code} {message}\r\n{long_msg}\r\n".encode()
         self.send_response(code, message)
         self.send_header("Content-Type", "text/plain")
-        self.send_header("Connection", "close")
-        self.send_header("Content-Length", "71\r\n")
+        self.send_header("Content-Length", len(body))
         self.end_headers()
+        if self.method != "HEAD":
+            self.push(body)
+        self.response_complete()
 
     def send_header(self, keyword, value):
-        self.sock.sendall(f'{keyword}: {value}\r\n'.encode())
+        self.output_headers.append(f'{keyword}: {value}\r\n'.encode())
 
     def send_response(self, code, message=''):
-        self.sock.sendall(f'{self.headers["protocol"]} {code} {message}\r\n'.encode())
+        self.output_headers.append(self.response_line(code, message))
+
+    def response_line(self, code, message=''):
+        self.status_code = code
+        protocol = self.protocol or "HTTP/1.1"
+        return (f'{protocol} {code} {message}\r\n'
+                f'Server: {SERVER_NAME}\r\n'
+                f'Date: {strftime("%a, %d %b %Y %H:%M:%S GMT", gmtime())}\r\n'
+                f'Connection: {"close" if self.close_connection else "keep-alive"}\r\n').encode()
 
     def end_headers(self):
-        self.sock.sendall(b'<html><head><title>Success</title></head><body>Index page</body></html>')
+        self.output_headers.append(b'\r\n')
+        self.push(b"".join(self.output_headers))
+        self.output_headers = []
 
-    def do_GET(self):
-        self.body = {}
+    def find_file(self):
+        url_path = self.url_path(self.uri)
+        entry = self.file_cache.get(url_path)
+        if entry is not None:
+            self.route = self.route_for(url_path)
+            return entry
+
+        try:
+            path = self.translate_path(url_path)
+        except ValueError:
+            # %00 in the URI unquotes to a NUL byte, which no file name
+            # can contain
+            self.send_error(400)
+            return None
+        if path is None:
+            self.send_error(403)
+            return None
+
+        try:
+            entry = self.file_cache.open(url_path, path, self.guess_type(path))
+            self.route = self.route_for(url_path)
+            return entry
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            if url_path.endswith("/"):
+                if self.autoindex and self.send_directory_index(url_path, os.path.dirname(path)):
+                    return None
+                self.send_error(403)
+            else:
+                self.send_error(404)
+        except OSError:
+            self.send_error(403)
+        return None
+
+    def send_directory_index(self, url_path, path):
+        try:
+            body = self.directory_index.get(url_path, path)
+        except OSError:
+            return False
+
+        self.route = self.route_for(url_path)
         self.send_response(200, 'OK')
-        self.send_header("Date", gmtime())
-        self.send_header("Content-Type", "text/html")
-        self.send_header("Content-Length", "71\r\n")
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        if self.method != "HEAD":
+            self.push(body)
+        self.response_complete()
+        return True
+
+    def route_for(self, url_path):
+        # requests are labelled by top-level directory, paths that were not
+        # found stay "-" so that the number of series is bounded
+        return url_path[:url_path.find("/", 1) + 1] or "/"
+
+    def send_head(self, entry):
+        self.send_response(200, 'OK')
+        self.output_headers.append(entry.headers)
+        self.output_headers.append(self.vary_header(entry))
+        self.end_headers()
+
+    def render_cached(self, entry):
+        response = self.response_cache.get(entry)
+        if response is None:
+            file = entry.acquire()
+            try:
+                body = os.pread(file.fileno(), entry.size, 0)
+            finally:
+                entry.release()
+            response = self.response_cache.put(
+                entry, entry.headers + b"\r\n", body)
+        return self.response_line(200, 'OK') + self.vary_header(entry) + response
+
+    def is_not_modified(self, entry, etag=None):
+        if etag is None:
+            etag = entry.etag
+
+        if_none_match = self.get_header("If-None-Match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # weak comparison, a W/ prefix does not matter for GET and HEAD
+            tags = (tag.strip() for tag in if_none_match.split(","))
+            return any(tag.removeprefix("W/") == etag for tag in tags)
+
+        if_modified_since = self.get_header("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                return False
+            return int(entry.mtime) <= since.timestamp()
+        return False
+
+    def send_not_modified(self, entry, validators=None):
+        self.send_response(304, 'Not Modified')
+        self.output_headers.append(validators or entry.validators)
+        self.output_headers.append(self.vary_header(entry))
+        self.end_headers()
+        self.response_complete()
+
+    def vary_header(self, entry):
+        if self.compression and is_compressible(entry.ctype):
+            return b"Vary: Accept-Encoding\r\n"
+        return b""
+
+    def accepted_encodings(self):
+        header = self.get_header("Accept-Encoding")
+        if not header:
+            return []
+
+        qvalues = {}
+        for item in header.split(","):
+            name, _, params = item.partition(";")
+            qvalue = 1.0
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        qvalue = float(value)
+                    except ValueError:
+                        qvalue = 0.0
+            qvalues[name.strip().lower()] = qvalue
+
+        default = qvalues.get("*", 0.0)
+        encodings = [(qvalues.get(encoding, default), encoding) for encoding in ENCODING_SUFFIXES]
+        # sorted() is stable, so on equal q-values br is preferred over gzip
+        return [encoding for qvalue, encoding in sorted(encodings, key=lambda x: -x[0]) if qvalue > 0]
+
+    def find_precompressed(self, entry, encoding):
+        key = ("precompressed", encoding, entry.path)
+        sibling = self.file_cache.get(key)
+        if sibling is not None:
+            return sibling
+
+        missing_since = entry.missing_siblings.get(encoding)
+        if missing_since is not None and monotonic() - missing_since < self.file_cache.ttl:
+            return None
+        try:
+            return self.file_cache.open(key, entry.path + ENCODING_SUFFIXES[encoding], entry.ctype)
+        except OSError:
+            entry.missing_siblings[encoding] = monotonic()
+            return None
+
+    def send_encoded(self, entry, head_only=False):
+        if not self.compression or not is_compressible(entry.ctype):
+            return False
+
+        for encoding in self.accepted_encodings():
+            source = self.find_precompressed(entry, encoding)
+            if source is not None:
+                body = None
+                etag = source.etag
+                validators = source.validators
+                size = source.size
+            else:
+                body = self.compression_cache.get(entry, encoding)
+                if body is None:
+                    continue
+                source = entry
+                etag = f'{entry.etag[:-1]}-{encoding}"'
+                validators = f"ETag: {etag}\r\nLast-Modified: {entry.last_modified}\r\n".encode()
+                size = len(body)
+
+            if self.is_not_modified(source, etag):
+                self.send_not_modified(entry, validators)
+                return True
+
+            self.send_response(200, 'OK')
+            self.output_headers.append((f"Content-Type: {entry.ctype}\r\n"
+                                        f"Content-Encoding: {encoding}\r\n"
+                                        f"Content-Length: {size}\r\n"
+                                        f"Vary: Accept-Encoding\r\n").encode() + validators)
+            self.end_headers()
+            if head_only:
+                source.acquire()
+                source.release()
+            elif body is not None:
+                self.push(body)
+            else:
+                self.push_with_producer(SendfileProducer(
+                    source.acquire(), count=source.size, release=source.release))
+            self.response_complete()
+            return True
+        return False
+
+    def do_GET(self):
+        entry = self.find_file()
+        if entry is None:
+            return
+
+        # ranges always refer to the identity encoding of the file
+        range_header = self.get_header("Range")
+        if range_header is None and self.send_encoded(entry):
+            return
+
+        if self.is_not_modified(entry):
+            self.send_not_modified(entry)
+            return
+
+        if range_header is not None and self.if_range_matches(entry):
+            ranges = self.parse_range(range_header, entry.size)
+            if ranges is not None:
+                self.send_ranges(entry, ranges)
+                return
+
+        if self.response_cache.accepts(entry):
+            self.push(self.render_cached(entry))
+        else:
+            self.send_head(entry)
+            self.push_with_producer(SendfileProducer(
+                entry.acquire(), count=entry.size, release=entry.release))
+        self.response_complete()
+
+    def if_range_matches(self, entry):
+        if_range = self.get_header("If-Range")
+        if if_range is None:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # If-Range requires the strong comparison
+            return if_range == entry.etag
+        return if_range == entry.last_modified
+
+    def parse_range(self, header, size):
+        # returns None when the header has to be ignored and an empty
+        # list when none of the ranges can be satisfied
+        unit, sep, spec = header.partition("=")
+        if unit.strip().lower() != "bytes" or not sep:
+            return None
+
+        parts = [part.strip() for part in spec.split(",") if part.strip()]
+        if not parts or len(parts) > self.max_ranges:
+            return None
+
+        ranges = []
+        for part in parts:
+            first, sep, last = part.partition("-")
+            if not sep:
+                return None
+            try:
+                if not first:
+                    length = int(last)
+                    if length <= 0:
+                        continue
+                    ranges.append((max(0, size - length), size - 1))
+                    continue
+                start = int(first)
+                end = int(last) if last else None
+            except ValueError:
+                return None
+            if start < 0 or (end is not None and end < start):
+                return None
+            if start < size:
+                ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+        return ranges
+
+    def send_ranges(self, entry, ranges):
+        if not ranges:
+            self.send_response(416, 'Range Not Satisfiable')
+            self.send_header("Content-Range", f"bytes */{entry.size}")
+            self.send_header("Content-Length", 0)
+            self.end_headers()
+            self.response_complete()
+            return
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(206, 'Partial Content')
+            self.send_header("Content-Type", entry.ctype)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{entry.size}")
+            self.send_header("Content-Length", end - start + 1)
+            self.output_headers.append(entry.validators)
+            self.end_headers()
+            self.push_with_producer(SendfileProducer(
+                entry.acquire(), offset=start, count=end - start + 1, release=entry.release))
+            self.response_complete()
+            return
+
+        boundary = os.urandom(12).hex()
+        parts = []
+        for start, end in ranges:
+            part_headers = (f"\r\n--{boundary}\r\n"
+                            f"Content-Type: {entry.ctype}\r\n"
+                            f"Content-Range: bytes {start}-{end}/{entry.size}\r\n\r\n").encode()
+            parts.append((part_headers, start, end - start + 1))
+        closing = f"\r\n--{boundary}--\r\n".encode()
+
+        self.send_response(206, 'Partial Content')
+        self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+        self.send_header("Content-Length",
+                         sum(len(part_headers) + count for part_headers, _, count in parts) + len(closing))
+        self.output_headers.append(entry.validators)
         self.end_headers()
+        for part_headers, start, count in parts:
+            self.push(part_headers)
+            self.push_with_producer(SendfileProducer(
+                entry.acquire(), offset=start, count=count, release=entry.release))
+        self.push(closing)
+        self.response_complete()
+
+    def do_HEAD(self):
+        entry = self.find_file()
+        if entry is None or self.send_encoded(entry, head_only=True):
+            return
+
+        if self.is_not_modified(entry):
+            self.send_not_modified(entry)
+        else:
+            self.send_head(entry)
+            entry.acquire()
+            entry.release()
+            self.response_complete()
+
+    def url_path(self, uri):
+        path = uri.split("?", 1)[0].split("#", 1)[0]
+        return url_normalize(urllib.parse.unquote(path))
 
     def translate_path(self, path):
-        pass
+        root = os.path.realpath(DOCUMENT_ROOT)
+        fullpath = os.path.realpath(os.path.join(root, *path.split("/")))
+        if fullpath != root and not fullpath.startswith(root + os.sep):
+            return None
+
+        if path.endswith("/"):
+            fullpath = os.path.join(fullpath, "index.html")
+        return fullpath
+
+    def guess_type(self, path):
+        ctype, _ = mimetypes.guess_type(path)
+        return ctype or "application/octet-stream"
 
     responses = {
         200: ('OK', 'Request fulfilled, document follows'),
+        206: ('Partial Content',
+              'Partial content follows'),
+        304: ('Not Modified',
+              'Document has not changed since given time'),
         400: ('Bad Request',
               'Bad request syntax or unsupported method'),
         403: ('Forbidden',
@@ -170,35 +1461,211 @@ class AsyncHTTPRequestHandler(asynchat.async_chat):
         404: ('Not Found', 'Nothing matches the given URI'),
         405: ('Method Not Allowed',
               'Specified method is invalid for this resource.'),
+        411: ('Length Required',
+              'Client must specify Content-Length.'),
+        413: ('Payload Too Large',
+              'Entity is too large.'),
+        408: ('Request Timeout',
+              'Request timed out; try again later.'),
+        416: ('Range Not Satisfiable',
+              'Cannot satisfy request range.'),
+        500: ('Internal Server Error',
+              'Server got itself in trouble'),
+        503: ('Service Unavailable',
+              'The server cannot process the request due to a high load'),
+        431: ('Request Header Fields Too Large',
+              'The server refused this request because the request header fields are too large.'),
     }
 
 
+class AsyncAppRequestHandler(AsyncHTTPRequestHandler):
+    # the request handling shared by the WSGI and ASGI servers, the
+    # request body is read from the connection and the application can
+    # wait until the client has taken what was written to it
+
+    consumes_body = True
+    max_body_size = 10 * 1024 * 1024
+
+    def __init__(self, server=None):
+        super().__init__(server)
+        self.body_remaining = 0
+        self.body_chunks = []
+        self.can_write = asyncio.Event()
+        self.can_write.set()
+
+    def pause_writing(self):
+        super().pause_writing()
+        self.can_write.clear()
+
+    def resume_writing(self):
+        self.can_write.set()
+        super().resume_writing()
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.can_write.set()
+
+    def read_deadline(self):
+        # a request body only has to keep making progress
+        if self.body_remaining:
+            return self.last_activity + self.read_timeout
+        return super().read_deadline()
+
+    def process_requests(self):
+        if self.body_remaining:
+            self.read_body()
+        super().process_requests()
+
+    def parse_request(self, request):
+        self.method, self.uri, self.protocol, self.headers = request
+        self.close_connection = not self.should_keep_alive()
+
+        if self.get_header("Transfer-Encoding"):
+            self.close_connection = True
+            self.send_error(411)
+            return
+        try:
+            length = int(self.get_header("Content-Length", "0"))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self.send_error(400)
+            return
+        if length > self.max_body_size:
+            self.close_connection = True
+            self.send_error(413)
+            return
+
+        self.busy = True
+        self.body_chunks = []
+        self.body_remaining = length
+        self.read_body()
+
+    def read_body(self):
+        buffer = self.parser.buffer
+        if self.body_remaining and buffer:
+            chunk = bytes(buffer[:self.body_remaining])
+            del buffer[:len(chunk)]
+            self.body_chunks.append(chunk)
+            self.body_remaining -= len(chunk)
+
+
+def load_application(name):
+    module_name, _, attr = name.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, attr or "application")
+
+
+def app_arg_parser(description, app):
+    parser = argparse.ArgumentParser(description)
+    parser.add_argument("--host", dest="host", default="127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=9000)
+    parser.add_argument("--log", dest="loglevel", default="info")
+    parser.add_argument("--access-log", dest="access_log", default=None)
+    parser.add_argument("--access-log-format", dest="access_log_format",
+                        choices=("common", "combined"), default="common")
+    parser.add_argument("--app", dest="app", default=app)
+    parser.add_argument("--uvloop", dest="use_uvloop", action="store_true")
+    return parser
+
+
+def run_app_server(args, server_class, **kwargs):
+    accesslog.setup_logging(level=getattr(logging, args.loglevel.upper()))
+    if args.access_log:
+        AsyncHTTPRequestHandler.access_log = accesslog.AccessLog(
+            accesslog.open_log(args.access_log), args.access_log_format)
+
+    server = server_class(host=args.host, port=args.port, use_uvloop=args.use_uvloop,
+                          application=load_application(args.app), **kwargs)
+    signal.signal(signal.SIGTERM, server.stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if AsyncHTTPRequestHandler.access_log is not None:
+            AsyncHTTPRequestHandler.access_log.close()
+
+
 def parse_args():
     parser = argparse.ArgumentParser("Simple asynchronous web-server")
     parser.add_argument("--host", dest="host", default="127.0.0.1")
     parser.add_argument("--port", dest="port", type=int, default=9000)
     parser.add_argument("--log", dest="loglevel", default="info")
     parser.add_argument("--logfile", dest="logfile", default=None)
+    parser.add_argument("--access-log", dest="access_log", default=None)
+    parser.add_argument("--access-log-format", dest="access_log_format",
+                        choices=("common", "combined"), default="common")
+    parser.add_argument("--trace-sample", dest="trace_sample", type=int, default=1)
+    parser.add_argument("--trace-rate", dest="trace_rate", type=float, default=0)
     parser.add_argument("-w", dest="nworkers", type=int, default=1)
+    parser.add_argument("--reuse-port", dest="reuse_port", action="store_true")
+    parser.add_argument("--uvloop", dest="use_uvloop", action="store_true")
+    parser.add_argument("--backlog", dest="backlog", type=int, default=1024)
+    parser.add_argument("--max-connections", dest="max_connections", type=int, default=0)
+    parser.add_argument("--retry-after", dest="retry_after", type=int, default=1)
+    parser.add_argument("--keep-alive-timeout", dest="keep_alive_timeout", type=float, default=5.0)
+    parser.add_argument("--read-timeout", dest="read_timeout", type=float, default=10.0)
+    parser.add_argument("--write-timeout", dest="write_timeout", type=float, default=30.0)
+    parser.add_argument("--max-requests", dest="max_requests", type=int, default=100)
+    parser.add_argument("--max-header-size", dest="max_header_size", type=int, default=8192)
+    parser.add_argument("--max-headers", dest="max_headers", type=int, default=100)
+    parser.add_argument("--write-buffer", dest="write_buffer", type=int, default=64 * 1024)
+    parser.add_argument("--compress", dest="compression", action="store_true")
+    parser.add_argument("--compress-cache", dest="compress_cache", type=int, default=8 * 1024 * 1024)
     parser.add_argument("-r", dest="document_root", default=".")
+    parser.add_argument("--autoindex", dest="autoindex", action="store_true")
+    parser.add_argument("--cache-size", dest="cache_size", type=int, default=128)
+    parser.add_argument("--cache-ttl", dest="cache_ttl", type=float, default=2.0)
+    parser.add_argument("--response-cache", dest="response_cache", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--response-threshold", dest="response_threshold", type=int, default=16 * 1024)
     return parser.parse_args()
 
 
 def run():
-    server = AsyncServer(host=args.host, port=args.port)
-    server.serve_forever()
+    server = AsyncServer(host=args.host, port=args.port, use_uvloop=args.use_uvloop,
+                         backlog=args.backlog, max_connections=args.max_connections)
+    signal.signal(signal.SIGTERM, server.stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("Response cache: %s", AsyncHTTPRequestHandler.response_cache.stats())
+        if AsyncHTTPRequestHandler.access_log is not None:
+            AsyncHTTPRequestHandler.access_log.close()
 
 
 if __name__ == "__main__":
     args = parse_args()
 
-    logging.basicConfig(
-        filename=args.logfile,
+    accesslog.setup_logging(
         level=getattr(logging, args.loglevel.upper()),
-        format="%(name)s: %(process)d %(message)s")
-    log = logging.getLogger(__name__)
+        filename=args.logfile,
+        sample=args.trace_sample,
+        rate=args.trace_rate)
+    if args.access_log:
+        AsyncHTTPRequestHandler.access_log = accesslog.AccessLog(
+            accesslog.open_log(args.access_log), args.access_log_format)
 
     DOCUMENT_ROOT = args.document_root
-    for _ in list(range(args.nworkers)):
-        p = multiprocessing.Process(target=run())
-        p.start()
\ No newline at end of file
+    AsyncHTTPRequestHandler.file_cache = FileCache(args.cache_size, args.cache_ttl)
+    AsyncHTTPRequestHandler.response_cache = ResponseCache(args.response_cache, args.response_threshold)
+    AsyncHTTPRequestHandler.keep_alive_timeout = args.keep_alive_timeout
+    AsyncHTTPRequestHandler.read_timeout = args.read_timeout
+    AsyncHTTPRequestHandler.write_timeout = args.write_timeout
+    AsyncHTTPRequestHandler.retry_after = args.retry_after
+    AsyncHTTPRequestHandler.max_keep_alive_requests = args.max_requests
+    AsyncHTTPRequestHandler.max_header_size = args.max_header_size
+    AsyncHTTPRequestHandler.max_headers = args.max_headers
+    AsyncHTTPRequestHandler.write_buffer_size = args.write_buffer
+    AsyncHTTPRequestHandler.compression = args.compression
+    AsyncHTTPRequestHandler.compression_cache = CompressionCache(args.compress_cache)
+    AsyncHTTPRequestHandler.autoindex = args.autoindex
+    if args.nworkers > 1:
+        PreforkServer(args.nworkers, host=args.host, port=args.port,
+                      reuse_port=args.reuse_port, use_uvloop=args.use_uvloop,
+                      backlog=args.backlog, max_connections=args.max_connections).serve_forever()
+    else:
+        run()
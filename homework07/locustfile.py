@@ -1,16 +1,136 @@
-from locust import HttpUser, between, task
+import logging
+import os
+import random
+import subprocess
+import sys
+from urllib.parse import quote
+
+from locust import HttpUser, between, events, task
+
+import benchutil
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOCUMENT_ROOT = os.environ.get("LOCUST_DOCUMENT_ROOT", os.path.join(HERE, "test_www"))
+
+IMAGES = (".gif", ".jpeg", ".jpg", ".png", ".svg", ".ico")
+
+
+def scan(root):
+    # the scenarios are built from what the server actually has to serve,
+    # every entry is (url, size) so a truncated body counts as a failure
+    files = {"html": [("/", None)], "asset": [], "image": [], "path": []}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith("__")]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in (".py", ".pyc"):
+                continue
+            entry = ("/" + quote(relpath), os.path.getsize(path))
+            if ext in (".html", ".htm") and relpath.count("/") < 2:
+                files["html"].append(entry)
+            elif ext in (".css", ".js"):
+                files["asset"].append(entry)
+            elif ext in IMAGES:
+                files["image"].append(entry)
+            else:
+                # deep directories and awkward names (spaces, double dots)
+                files["path"].append(entry)
+    return files
+
+
+FILES = scan(DOCUMENT_ROOT)
+
+
 class WebsiteUser(HttpUser):
-    wait_time = between(5,15)
-
-    def on_start(self):
-        self.client.post("/login",{
-            "username":"test_user",
-            "password":""
-        })
-    @task
-    def index(self):
-        self.client.get("/")
-        self.client.get("/static/assets.js")
-    @task
-    def about(self):
-        self.client.get("/about/")
\ No newline at end of file
+    wait_time = between(0, 0.1)
+
+    def fetch(self, method, kind, url, size=None, status=200):
+        with self.client.request(method, url, name=f"{method} {kind}", catch_response=True,
+                                 allow_redirects=False) as response:
+            if response.status_code != status:
+                response.failure(f"status {response.status_code} instead of {status}")
+            elif method == "HEAD" and response.content:
+                response.failure("HEAD response has a body")
+            elif method == "GET" and size is not None and len(response.content) != size:
+                response.failure(f"{len(response.content)} bytes instead of {size}")
+            else:
+                response.success()
+
+    def get(self, kind):
+        if FILES[kind]:
+            self.fetch("GET", kind, *random.choice(FILES[kind]))
+
+    @task(10)
+    def html(self):
+        self.get("html")
+
+    @task(4)
+    def asset(self):
+        self.get("asset")
+
+    @task(3)
+    def image(self):
+        self.get("image")
+
+    @task(2)
+    def path(self):
+        self.get("path")
+
+    @task(3)
+    def head(self):
+        kind = random.choice([kind for kind in FILES if FILES[kind]])
+        url, _ = random.choice(FILES[kind])
+        self.fetch("HEAD", kind, url)
+
+    @task(1)
+    def missing(self):
+        self.fetch("GET", "missing", f"/dir1/missing-{random.randrange(1000)}.html", status=404)
+
+
+@events.init_command_line_parser.add_listener
+def add_thresholds(parser):
+    parser.add_argument("--max-fail-ratio", type=float, default=0.01)
+    parser.add_argument("--max-p50", type=float, default=0, help="milliseconds, 0 disables the check")
+    parser.add_argument("--max-p99", type=float, default=0, help="milliseconds, 0 disables the check")
+    parser.add_argument("--min-rps", type=float, default=0, help="0 disables the check")
+
+
+@events.quitting.add_listener
+def check_thresholds(environment, **kwargs):
+    options = environment.parsed_options
+    if options is None:
+        return
+
+    total = environment.stats.total
+    failed = []
+    if total.fail_ratio > options.max_fail_ratio:
+        failed.append(f"fail ratio {total.fail_ratio:.2%} > {options.max_fail_ratio:.2%}")
+    for name, limit, q in (("p50", options.max_p50, 0.5), ("p99", options.max_p99, 0.99)):
+        value = total.get_response_time_percentile(q)
+        if limit and value > limit:
+            failed.append(f"{name} {value:.0f} ms > {limit:.0f} ms")
+    if options.min_rps and total.total_rps < options.min_rps:
+        failed.append(f"{total.total_rps:.1f} req/s < {options.min_rps:.1f} req/s")
+
+    for reason in failed:
+        logging.error("Threshold failed: %s", reason)
+    if failed:
+        environment.process_exit_code = 1
+
+
+if __name__ == "__main__":
+    # python locustfile.py [locust options] runs httpd.py over the document
+    # root on a free port and a headless locust against it; the exit code
+    # is non-zero when a threshold is missed
+    port = benchutil.free_port()
+    command = [sys.executable, "httpd.py", "-r", DOCUMENT_ROOT, "--log", "warning"]
+    try:
+        with benchutil.running_server(command, port):
+            code = subprocess.call([sys.executable, "-m", "locust", "-f", os.path.abspath(__file__), "--headless",
+                                    "--host", f"http://127.0.0.1:{port}", "-u", "50", "-r", "10", "-t", "30s",
+                                    "--only-summary", "--max-p99", "200"] + sys.argv[1:])
+    except RuntimeError as e:
+        sys.exit(f"httpd.py did not start: {e}")
+    sys.exit(code)
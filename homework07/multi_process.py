@@ -1,23 +1,29 @@
+import argparse
+import asyncio
 import socket
+import signal
 import threading
 import multiprocessing
+import multiprocessing.connection
 import time
 import logging
 
-logging.basicConfig(
+import accesslog
+
+accesslog.setup_logging(
     level=logging.DEBUG,
-    format='[%(levelname)s] (%(processName)-10s) (%(threadName)-10s) %(message)s'
+    fmt='[%(levelname)s] (%(processName)-10s) (%(threadName)-10s) %(message)s'
 )
 
 def worker_thread(serversocket):
     while True:
         clientsocket, (client_address, client_port) = serversocket.accept()
-        logging.debug(f"New client {client_address}:{client_port}")
+        logging.debug("New client %s:%s", client_address, client_port)
 
         while True:
             try:
                 data = clientsocket.recv(1024)
-                logging.debug(f"Recv: {data} from {client_address}:{client_port}")
+                logging.debug("Recv: %s from %s:%s", data, client_address, client_port)
             except OSError:
                 break
 
@@ -30,12 +36,15 @@ def worker_thread(serversocket):
                 if sent_len == len(data):
                     break
                 sent_data = sent_data[sent_len:]
-            logging.debug(f"Send: {data} to {client_address}:{client_port}")
+            logging.debug("Send: %s to %s:%s", data, client_address, client_port)
 
         clientsocket.close()
-        logging.debug(f"Bye-bye: {client_address}:{client_port}")
+        logging.debug("Bye-bye: %s:%s", client_address, client_port)
 
 def worker_process(serversocket):
+    # the master terminates the workers, Ctrl-C in the terminal reaches
+    # the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     NUMBER_OF_THREADS = 10
     for _ in range(NUMBER_OF_THREADS):
         thread = threading.Thread(target=worker_thread,
@@ -46,22 +55,129 @@ def worker_process(serversocket):
     while True:
         time.sleep(1)
 
-def main(host='localhost', port=9090):
+class EchoProtocol(asyncio.Protocol):
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client_address, self.client_port = transport.get_extra_info("peername")[:2]
+        logging.debug("New client %s:%s", self.client_address, self.client_port)
+
+    def data_received(self, data):
+        logging.debug("Recv: %s from %s:%s", data, self.client_address, self.client_port)
+        self.transport.write(data)
+
+    def pause_writing(self):
+        # a client that does not read its echo is not read from either
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        logging.debug("Bye-bye: %s:%s", self.client_address, self.client_port)
+
+
+def event_loop_worker(host, port):
+    # every worker listens on its own SO_REUSEPORT socket, the kernel
+    # spreads new connections over them instead of waking every process
+    serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+    serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+    serversocket.bind((host, port))
+    serversocket.listen(1024)
+
+    loop = asyncio.new_event_loop()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    server = loop.run_until_complete(loop.create_server(EchoProtocol, sock=serversocket))
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.close()
+
+
+def supervise(host, port, processes):
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    def spawn():
+        process = multiprocessing.Process(target=event_loop_worker, args=(host, port))
+        process.start()
+        workers[process.sentinel] = (process, time.monotonic())
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    workers = {}
+    for _ in range(processes):
+        spawn()
+
+    while not stopping:
+        for sentinel in multiprocessing.connection.wait(list(workers), timeout=1.0):
+            process, started = workers.pop(sentinel)
+            process.join()
+            if stopping:
+                break
+            logging.warning("Worker %s exited with code %s, restarting", process.pid, process.exitcode)
+            # a worker that dies right away would otherwise be restarted
+            # in a tight loop
+            if time.monotonic() - started < 1.0:
+                time.sleep(1.0)
+            spawn()
+
+    for process, _ in workers.values():
+        process.terminate()
+    for process, _ in workers.values():
+        process.join()
+
+
+def main(host='localhost', port=9090, mode="threads", processes=None):
+    NUMBER_OF_PROCESS = processes or multiprocessing.cpu_count()
+    if mode == "loop":
+        logging.debug("Number of processes %s", NUMBER_OF_PROCESS)
+        supervise(host, port, NUMBER_OF_PROCESS)
+        return
+
     serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
     serversocket.bind((host, port))
     serversocket.listen(5)
 
-    NUMBER_OF_PROCESS = multiprocessing.cpu_count()
-    logging.debug(f"Number of processes {NUMBER_OF_PROCESS}")
+    logging.debug("Number of processes %s", NUMBER_OF_PROCESS)
+    processes = []
     for _ in range(NUMBER_OF_PROCESS):
         process = multiprocessing.Process(target=worker_process,
             args=(serversocket,))
         process.daemon = True
         process.start()
+        processes.append(process)
 
-    while True:
-        time.sleep(1)
+    # without a handler SIGTERM kills only the master and the workers keep
+    # accepting on the inherited socket
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser("Multiprocess echo server")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    parser.add_argument("--mode", dest="mode", choices=("threads", "loop"), default="threads",
+                        help="blocking threads on a shared socket, or an event loop per process")
+    parser.add_argument("-w", dest="processes", type=int, default=None)
+    args = parser.parse_args()
+    main(args.host, args.port, args.mode, args.processes)
\ No newline at end of file
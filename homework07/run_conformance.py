@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import socket
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import benchutil
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOCUMENT_ROOT = os.path.join(HERE, "test_www")
+
+PIPELINE_FILES = ["/dir1/page.html", "/dir1/dir2/dir3/quote.txt", "/dir1/text..txt", "/index.html"]
+
+
+class Timings:
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.failures = []
+
+    def record(self, started, error=None):
+        self.latencies.append(time.perf_counter() - started)
+        if error is not None:
+            self.failures.append(error)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+
+        def ms(q):
+            if not latencies:
+                return None
+            return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 3)
+
+        return {
+            "test": self.name,
+            "runs": len(latencies),
+            "failed": len(self.failures),
+            "p50_ms": ms(0.5),
+            "p99_ms": ms(0.99),
+            "max_ms": ms(1.0),
+            "errors": sorted(set(self.failures))[:5],
+        }
+
+
+def run_conformance(port, clients, repeat):
+    # every test method runs `repeat` times, spread over `clients` threads
+    # so the server sees the whole suite at once instead of one by one
+    try:
+        import test_async_server_py
+    except ImportError as e:
+        print(f"skipping conformance tests: {e}")
+        return []
+
+    case = test_async_server_py.TestAsyncHTTPServer
+    case.host = "http://127.0.0.1"
+    case.port = port
+    names = unittest.TestLoader().getTestCaseNames(case)
+    timings = {name: Timings(name) for name in names}
+
+    def run(name):
+        result = unittest.TestResult()
+        started = time.perf_counter()
+        case(name).run(result)
+        error = None
+        for _, trace in result.failures + result.errors:
+            error = trace.strip().splitlines()[-1]
+        timings[name].record(started, error)
+
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(run, [name for _ in range(repeat) for name in names]))
+    return list(timings.values())
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, *lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines:
+        if line:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+    return int(status_line.split()[1]), headers
+
+
+def request(path, close=False):
+    connection = "close" if close else "keep-alive"
+    return f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: {connection}\r\n\r\n".encode()
+
+
+def expected_body(path):
+    with open(os.path.join(DOCUMENT_ROOT, path.lstrip("/")), "rb") as f:
+        return f.read()
+
+
+async def get(port, path, timings, timeout):
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+        try:
+            writer.write(request(path, close=True))
+            status, headers = await asyncio.wait_for(read_response(reader), timeout)
+            body = await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+        finally:
+            writer.close()
+        error = None
+        if status != 200:
+            error = f"status {status}"
+        elif body != expected_body(path):
+            error = "body differs from the file"
+    except (OSError, KeyError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        error = f"{type(e).__name__}: {e}"
+    timings.record(started, error)
+
+
+async def stress_connections(port, connections, timeout):
+    # all connections are open at the same time before any request is sent
+    timings = Timings(f"stress_{connections}_connections")
+    opened = await asyncio.gather(*(asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+                                    for _ in range(connections)), return_exceptions=True)
+
+    async def exchange(connection):
+        started = time.perf_counter()
+        if isinstance(connection, BaseException):
+            timings.record(started, f"connect: {type(connection).__name__}")
+            return
+        reader, writer = connection
+        error = None
+        try:
+            writer.write(request("/dir1/page.html"))
+            status, headers = await asyncio.wait_for(read_response(reader), timeout)
+            body = await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+            if status != 200 or body != expected_body("/dir1/page.html"):
+                error = f"status {status}" if status != 200 else "body differs from the file"
+        except (OSError, KeyError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            writer.close()
+        timings.record(started, error)
+
+    await asyncio.gather(*(exchange(connection) for connection in opened))
+    return [timings]
+
+
+async def stress_slow_readers(port, readers, timeout):
+    # clients with a tiny receive window read a large file a few KB at a
+    # time; meanwhile requests from fast clients must not queue behind them
+    path = "/dir1/bootstrap.css"
+    expected = expected_body(path)
+    slow = Timings(f"stress_{readers}_slow_readers")
+    fast = Timings("stress_fast_during_slow")
+    loop = asyncio.get_running_loop()
+
+    async def slow_reader():
+        started = time.perf_counter()
+        error = None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, ("127.0.0.1", port))
+            reader, writer = await asyncio.open_connection(sock=sock, limit=4096)
+            try:
+                writer.write(request(path, close=True))
+                status, headers = await asyncio.wait_for(read_response(reader), timeout)
+                body = bytearray()
+                while len(body) < int(headers["content-length"]):
+                    chunk = await asyncio.wait_for(reader.read(4096), timeout)
+                    if not chunk:
+                        break
+                    body += chunk
+                    await asyncio.sleep(0.01)
+                if status != 200 or body != expected:
+                    error = f"status {status}" if status != 200 else "body differs from the file"
+            finally:
+                writer.close()
+        except (OSError, KeyError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            sock.close()
+            error = f"{type(e).__name__}: {e}"
+        slow.record(started, error)
+
+    async def fast_clients(deadline):
+        while time.perf_counter() < deadline:
+            await get(port, "/dir1/page.html", fast, timeout)
+
+    tasks = [asyncio.ensure_future(slow_reader()) for _ in range(readers)]
+    await asyncio.sleep(0.1)
+    await asyncio.gather(*(fast_clients(time.perf_counter() + 1.0) for _ in range(4)))
+    await asyncio.gather(*tasks)
+    return [slow, fast]
+
+
+async def stress_pipelining(port, connections, depth, timeout):
+    # each connection sends all of its requests in one write, the answers
+    # have to come back complete and in order
+    timings = Timings(f"stress_pipelined_{depth}_deep")
+    paths = [PIPELINE_FILES[i % len(PIPELINE_FILES)] for i in range(depth)]
+
+    async def pipeline():
+        started = time.perf_counter()
+        error = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            try:
+                writer.write(b"".join(request(path) for path in paths))
+                for i, path in enumerate(paths):
+                    status, headers = await asyncio.wait_for(read_response(reader), timeout)
+                    body = await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+                    if status != 200 or body != expected_body(path):
+                        error = f"response {i} ({path}) is wrong"
+                        break
+            finally:
+                writer.close()
+        except (OSError, KeyError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            error = f"{type(e).__name__}: {e}"
+        timings.record(started, error)
+
+    await asyncio.gather(*(pipeline() for _ in range(connections)))
+    return [timings]
+
+
+def print_row(row):
+    latencies = " ".join("{:>9}".format("-" if row[key] is None else f"{row[key]:.2f}")
+                         for key in ("p50_ms", "p99_ms", "max_ms"))
+    print(f"{row['test']:>32} {row['runs']:>6} {row['failed']:>6} {latencies}")
+    for error in row["errors"]:
+        print(f"{'':>32} {error}")
+
+
+def main(args):
+    port = benchutil.free_port()
+    try:
+        with benchutil.running_server(shlex.split(args.server), port):
+            timings = run_conformance(port, args.clients, args.repeat)
+            timings += asyncio.run(stress_connections(port, args.connections, args.timeout))
+            timings += asyncio.run(stress_slow_readers(port, args.slow_readers, args.timeout))
+            timings += asyncio.run(stress_pipelining(port, args.clients, args.depth, args.timeout))
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    rows = [t.summary() for t in timings]
+    print(f"{'test':>32} {'runs':>6} {'failed':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in rows:
+        print_row(row)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"server": args.server, "results": rows}, f, indent=2)
+    return 1 if any(row["failed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Concurrent conformance and stress tests")
+    parser.add_argument("--server", dest="server", default=f"{sys.executable} httpd.py -r test_www --log warning",
+                        help="command that starts the server, --port is appended")
+    parser.add_argument("-c", dest="clients", type=int, default=16,
+                        help="concurrent clients for the conformance suite and pipelining")
+    parser.add_argument("-n", dest="repeat", type=int, default=10, help="runs of every conformance test")
+    parser.add_argument("--connections", dest="connections", type=int, default=1000)
+    parser.add_argument("--slow-readers", dest="slow_readers", type=int, default=20)
+    parser.add_argument("--depth", dest="depth", type=int, default=50,
+                        help="pipelined requests per connection, at most the server's --max-requests")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=10.0)
+    parser.add_argument("--json", dest="output", default=None)
+    sys.exit(main(parser.parse_args()))
@@ -1,72 +1,303 @@
-import socket
-import select
+import argparse
+import errno
 import logging
+import select
+import selectors
+import socket
+from time import monotonic
 
-logging.basicConfig(
+import accesslog
+
+accesslog.setup_logging(
     level=logging.DEBUG,
-    format='[%(levelname)s] (%(processName)-10s) (%(threadName)-10s) %(message)s'
+    fmt='[%(levelname)s] (%(processName)-10s) (%(threadName)-10s) %(message)s'
 )
 
-read_waiters = {}
-write_waiters = {}
-connections = {}
+EVENT_READ = selectors.EVENT_READ
+EVENT_WRITE = selectors.EVENT_WRITE
+
+
+class SelectorPoller:
+    # registrations are persistent, interest is only changed with modify()
+    edge_triggered = False
+
+    def __init__(self, selector_class=selectors.DefaultSelector) -> None:
+        self.selector = selector_class()
+
+    def register(self, sock, events, handler) -> None:
+        self.selector.register(sock, events, handler)
+
+    def modify(self, sock, events, handler) -> None:
+        self.selector.modify(sock, events, handler)
+
+    def unregister(self, sock) -> None:
+        self.selector.unregister(sock)
+
+    def poll(self, timeout):
+        return [(key.data, events) for key, events in self.selector.select(timeout)]
+
+    def close(self) -> None:
+        self.selector.close()
+
+
+class EpollPoller:
+    # edge-triggered epoll: an event is only reported when the state of the
+    # socket changes, so every handler reads, writes or accepts until EAGAIN
+    edge_triggered = True
+
+    def __init__(self) -> None:
+        self.epoll = select.epoll()
+        self.handlers = {}
+
+    @staticmethod
+    def mask(events) -> int:
+        mask = select.EPOLLET
+        if events & EVENT_READ:
+            mask |= select.EPOLLIN | select.EPOLLRDHUP
+        if events & EVENT_WRITE:
+            mask |= select.EPOLLOUT
+        return mask
+
+    def register(self, sock, events, handler) -> None:
+        fd = sock.fileno()
+        self.epoll.register(fd, self.mask(events))
+        self.handlers[fd] = handler
+
+    def modify(self, sock, events, handler) -> None:
+        # EPOLL_CTL_MOD re-arms the registration, data that is already
+        # waiting is reported again even though no new edge happened
+        fd = sock.fileno()
+        self.epoll.modify(fd, self.mask(events))
+        self.handlers[fd] = handler
+
+    def unregister(self, sock) -> None:
+        fd = sock.fileno()
+        self.epoll.unregister(fd)
+        del self.handlers[fd]
+
+    def poll(self, timeout):
+        ready = []
+        for fd, mask in self.epoll.poll(-1 if timeout is None else timeout):
+            events = 0
+            if mask & (select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLHUP | select.EPOLLERR):
+                events |= EVENT_READ
+            if mask & (select.EPOLLOUT | select.EPOLLHUP | select.EPOLLERR):
+                events |= EVENT_WRITE
+            ready.append((self.handlers[fd], events))
+        return ready
+
+    def close(self) -> None:
+        self.epoll.close()
+
+
+POLLERS = {
+    "default": lambda: SelectorPoller(selectors.DefaultSelector),
+    "select": lambda: SelectorPoller(selectors.SelectSelector),
+}
+if hasattr(selectors, "PollSelector"):
+    POLLERS["poll"] = lambda: SelectorPoller(selectors.PollSelector)
+if hasattr(selectors, "EpollSelector"):
+    POLLERS["epoll"] = lambda: SelectorPoller(selectors.EpollSelector)
+    POLLERS["epoll-et"] = EpollPoller
+if hasattr(selectors, "KqueueSelector"):
+    POLLERS["kqueue"] = lambda: SelectorPoller(selectors.KqueueSelector)
+
 
-def accept_handler(serversocket: socket.socket) -> None:
-    clientsocket, (client_address, client_port) = serversocket.accept()
-    clientsocket.setblocking(False)
-    logging.debug(f"New client: {client_address}:{client_port}")
-    connections[clientsocket.fileno()] = (clientsocket, client_address, client_port)
-    read_waiters[clientsocket.fileno()] = (recv_handler, (clientsocket.fileno(),))
-    read_waiters[serversocket.fileno()] = (accept_handler, (serversocket,))
+class TimerWheel:
+    # hashed timing wheel: scheduling is an append to the slot of the
+    # deadline and every tick only looks at one slot, entries further away
+    # than one turn of the wheel stay in their slot until their round comes
 
-def recv_handler(fileno) -> None:
-    def terminate():
-        del connections[clientsocket.fileno()]
-        clientsocket.close()
-        logging.debug(f"Bye-Bye: {client_address}:{client_port}")
+    def __init__(self, tick: float = 1.0, size: int = 512) -> None:
+        self.tick = tick
+        self.slots = [[] for _ in range(size)]
+        self.current = int(monotonic() / tick)
 
-    clientsocket, client_address, client_port = connections[fileno]
+    def schedule(self, deadline: float, item) -> None:
+        target = max(int(deadline / self.tick) + 1, self.current + 1)
+        self.slots[target % len(self.slots)].append((target, item))
 
+    def expire(self, now: float):
+        expired = []
+        last = int(now / self.tick)
+        while self.current < last:
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            if slot:
+                pending = [entry for entry in slot if entry[0] > self.current]
+                expired.extend(item for target, item in slot if target <= self.current)
+                slot[:] = pending
+        return expired
+
+    def timeout(self, now: float) -> float:
+        return max(0.0, (self.current + 1) * self.tick - now)
+
+
+class Connection:
+
+    def __init__(self, server, sock: socket.socket, address: str, port: int) -> None:
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.port = port
+        self.output = bytearray()
+        self.events = EVENT_READ
+        self.read_stalled = False
+        self.closed = False
+        self.last_activity = monotonic()
+
+    def handle_event(self, events) -> None:
+        if events & EVENT_READ:
+            self.handle_read()
+        if events & EVENT_WRITE and not self.closed:
+            self.handle_write()
+
+    def handle_read(self) -> None:
+        self.last_activity = monotonic()
+        while True:
+            if len(self.output) >= self.server.max_output:
+                # unread data is left behind without an EAGAIN, an edge
+                # triggered poller will not report it again by itself
+                self.read_stalled = self.server.poller.edge_triggered
+                break
+            try:
+                message = self.sock.recv(self.server.recv_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.close()
+                return
+
+            if len(message) == 0:
+                self.close()
+                return
+
+            logging.debug("Recv: %s from %s:%s", message, self.address, self.port)
+            self.output += message
+            if not self.server.poller.edge_triggered:
+                # level-triggered pollers report the socket again anyway
+                break
+
+        if self.output:
+            self.handle_write()
+
+    def handle_write(self) -> None:
+        while self.output:
+            try:
+                sent_len = self.sock.send(self.output)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.close()
+                return
+            logging.debug("Send: %s to %s:%s", self.output[:sent_len], self.address, self.port)
+            del self.output[:sent_len]
+
+        # reading stops while the client does not take its echo back
+        events = EVENT_WRITE if self.output else 0
+        if len(self.output) < self.server.max_output:
+            events |= EVENT_READ
+        if events != self.events or self.read_stalled and events & EVENT_READ:
+            self.read_stalled = False
+            self.events = events
+            self.server.poller.modify(self.sock, events, self)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.server.poller.unregister(self.sock)
+        del self.server.connections[self.sock.fileno()]
+        self.sock.close()
+        logging.debug("Bye-Bye: %s:%s", self.address, self.port)
+
+
+class EchoServer:
+
+    def __init__(self, host: str = 'localhost', port: int = 9090, poller: str = "default",
+                 idle_timeout: float = 300.0, backlog: int = 1024,
+                 recv_size: int = 65536, max_output: int = 256 * 1024) -> None:
+        self.poller = POLLERS[poller]()
+        self.idle_timeout = idle_timeout
+        self.recv_size = recv_size
+        self.max_output = max_output
+        self.timers = TimerWheel()
+        self.connections = {}
+
+        self.serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serversocket.setblocking(False)
+        self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+        self.serversocket.bind((host, port))
+        self.serversocket.listen(backlog)
+        self.poller.register(self.serversocket, EVENT_READ, self)
+
+    def handle_event(self, events) -> None:
+        # the listening socket stays registered, every wakeup accepts as
+        # many pending connections as the backlog holds
+        while True:
+            try:
+                clientsocket, (client_address, client_port) = self.serversocket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                    logging.warning("Cannot accept: %s", e)
+                    return
+                raise
+
+            clientsocket.setblocking(False)
+            logging.debug("New client: %s:%s", client_address, client_port)
+            connection = Connection(self, clientsocket, client_address, client_port)
+            self.connections[clientsocket.fileno()] = connection
+            self.poller.register(clientsocket, EVENT_READ, connection)
+            if self.idle_timeout:
+                self.timers.schedule(connection.last_activity + self.idle_timeout, connection)
+
+    def expire_idle(self, now: float) -> None:
+        # activity does not touch the wheel, a connection that was used
+        # since it was scheduled is only moved to its new deadline here
+        for connection in self.timers.expire(now):
+            if connection.closed:
+                continue
+            deadline = connection.last_activity + self.idle_timeout
+            if deadline <= now:
+                logging.debug("Idle timeout: %s:%s", connection.address, connection.port)
+                connection.close()
+            else:
+                self.timers.schedule(deadline, connection)
+
+    def serve_forever(self) -> None:
+        while True:
+            timeout = self.timers.timeout(monotonic()) if self.idle_timeout else None
+            for handler, events in self.poller.poll(timeout):
+                handler.handle_event(events)
+            if self.idle_timeout:
+                self.expire_idle(monotonic())
+
+    def close(self) -> None:
+        for connection in list(self.connections.values()):
+            connection.close()
+        self.poller.unregister(self.serversocket)
+        self.serversocket.close()
+        self.poller.close()
+
+
+def main(host: str = 'localhost', port: int = 9090, poller: str = "default",
+         idle_timeout: float = 300.0) -> None:
+    server = EchoServer(host, port, poller=poller, idle_timeout=idle_timeout)
     try:
-        message = clientsocket.recv(1024)
-    except OSError:
-        terminate()
-        return
-
-    if len(message) == 0:
-        terminate()
-        return
-
-    logging.debug(f"Recv: {message} from {client_address}:{client_port}")
-    write_waiters[fileno] = (send_handler, (fileno, message))
-
-def send_handler(fileno, message) -> None:
-    clientsocket, client_address, client_port = connections[fileno]
-    sent_len = clientsocket.send(message)
-    logging.debug("Send: {} to {}:{}".format(message[:sent_len], client_address, client_port))
-    if sent_len == len(message):
-        read_waiters[clientsocket.fileno()] = (recv_handler, (clientsocket.fileno(),))
-    else:
-        write_waiters[fileno] = (send_handler, (fileno, message[sent_len:]))
-
-def main(host: str = 'localhost', port: int = 9090) -> None:
-    serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    serversocket.setblocking(False)
-    serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-    serversocket.bind((host, port))
-    serversocket.listen(128)
-
-    read_waiters[serversocket.fileno()] = (accept_handler, (serversocket,))
-    while True:
-        rlist, wlist, _ = select.select(read_waiters.keys(), write_waiters.keys(), [], 60)
-
-        for r_fileno in rlist:
-            handler, args = read_waiters.pop(r_fileno)
-            handler(*args)
-
-        for w_fileno in wlist:
-            handler, args = write_waiters.pop(w_fileno)
-            handler(*args)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser("Event loop echo server")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    parser.add_argument("--poller", dest="poller", choices=sorted(POLLERS), default="default")
+    parser.add_argument("--idle-timeout", dest="idle_timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    main(args.host, args.port, args.poller, args.idle_timeout)
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import logging
+import signal
+
+import accesslog
+
+log = logging.getLogger(__name__)
+
+
+class BufferPool:
+    # receive buffers are allocated up front and passed from a closed
+    # connection to the next one instead of a new object per recv
+
+    def __init__(self, size: int = 16384, count: int = 256) -> None:
+        self.size = size
+        self.count = count
+        self.free = [bytearray(size) for _ in range(count)]
+        self.allocated = count
+
+    def acquire(self) -> bytearray:
+        if self.free:
+            return self.free.pop()
+        self.allocated += 1
+        return bytearray(self.size)
+
+    def release(self, buffer: bytearray) -> None:
+        if len(self.free) < self.count:
+            self.free.append(buffer)
+
+    def stats(self) -> dict:
+        return {"size": self.size, "free": len(self.free), "allocated": self.allocated}
+
+
+class EchoProtocol(asyncio.BufferedProtocol):
+    # the transport calls recv_into on the buffer from get_buffer and the
+    # echo is written from a memoryview slice of it
+
+    def __init__(self, pool: BufferPool) -> None:
+        self.pool = pool
+        self.transport = None
+        self.buffer = None
+        self.view = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")
+        self.buffer = self.pool.acquire()
+        self.view = memoryview(self.buffer)
+        # any part of an echo left in the transport pauses reading, so the
+        # buffer is not refilled while queued data may still point into it
+        transport.set_write_buffer_limits(high=0)
+        log.debug("New client %s:%s", *self.peer[:2])
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.view
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.transport.write(self.view[:nbytes])
+
+    def pause_writing(self) -> None:
+        self.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc) -> None:
+        self.view = None
+        self.pool.release(self.buffer)
+        self.buffer = None
+        log.debug("Bye-bye: %s:%s", *self.peer[:2])
+
+
+async def serve(host: str, port: int, recv_size: int, pool_size: int, backlog: int) -> None:
+    loop = asyncio.get_running_loop()
+    pool = BufferPool(recv_size, pool_size)
+    server = await loop.create_server(lambda: EchoProtocol(pool), host, port, backlog=backlog)
+    stopped = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopped.set)
+
+    log.info("Starting Echo Server at %s:%s", host, port)
+    async with server:
+        await stopped.wait()
+    log.info("Buffer pool: %s", pool.stats())
+
+
+def main(host: str = 'localhost', port: int = 9090, recv_size: int = 16384, pool_size: int = 256,
+         backlog: int = 1024) -> None:
+    try:
+        asyncio.run(serve(host, port, recv_size, pool_size, backlog))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Asyncio TCP echo server with pooled receive buffers")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    parser.add_argument("--log", dest="loglevel", default="info")
+    parser.add_argument("--recv-size", dest="recv_size", type=int, default=16384)
+    parser.add_argument("--pool", dest="pool_size", type=int, default=256,
+                        help="receive buffers allocated at startup and kept for reuse")
+    parser.add_argument("--backlog", dest="backlog", type=int, default=1024)
+    args = parser.parse_args()
+
+    accesslog.setup_logging(
+        level=getattr(logging, args.loglevel.upper()),
+        fmt='[%(levelname)s] %(message)s'
+    )
+    main(args.host, args.port, args.recv_size, args.pool_size, args.backlog)
@@ -1,10 +1,14 @@
+import argparse
 import socket
 import threading
 import logging
 
-logging.basicConfig(
+import accesslog
+import workerpool
+
+accesslog.setup_logging(
     level=logging.DEBUG,
-    format='[%(levelname)s] (%(threadName)-10s) %(message)s'
+    fmt='[%(levelname)s] (%(threadName)-10s) %(message)s'
 )
 
 
@@ -12,7 +16,7 @@ def client_handler(sock: socket.socket, address: str, port: int) -> None:
     while True:
         try:
             message = sock.recv(1024)
-            logging.debug(f"Recv: {message} from {address}:{port}")
+            logging.debug("Recv: %s from %s:%s", message, address, port)
         except OSError:
             break
 
@@ -25,23 +29,37 @@ def client_handler(sock: socket.socket, address: str, port: int) -> None:
             if sent_len == len(sent_message):
                 break
             sent_message = sent_message[sent_len:]
-        logging.debug(f"Send: {message} to {address}:{port}")
+        logging.debug("Send: %s to %s:%s", message, address, port)
     sock.close()
-    logging.debug(f"Bye-bye: {address}:{port}")
+    logging.debug("Bye-bye: %s:%s", address, port)
+
 
+def reject_client(sock: socket.socket, address: str, port: int) -> None:
+    logging.debug("Rejected: %s:%s", address, port)
+    sock.close()
 
-def main(host: str = 'localhost', port: int = 9090) -> None:
+
+def main(host: str = 'localhost', port: int = 9090, workers: int = 0, queue_size: int = 64,
+         policy: str = "reject", stats_interval: float = 10.0) -> None:
     serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
     serversocket.bind((host, port))
     serversocket.listen(128)
     socket.setdefaulttimeout(10)
 
+    pool = None
+    if workers:
+        pool = workerpool.WorkerPool(client_handler, workers, queue_size, policy, reject_client)
+        pool.report_every(stats_interval)
+
     print(f"Starting TCP Echo Server at {host}:{port}")
     try:
         while True:
             clientsocket, (client_address, client_port) = serversocket.accept()
-            logging.debug(f"New client: {client_address}:{client_port}")
+            logging.debug("New client: %s:%s", client_address, client_port)
+            if pool is not None:
+                pool.submit(clientsocket, client_address, client_port)
+                continue
             client_thread = threading.Thread(
                 target=client_handler,
                 args=(clientsocket, client_address, client_port))
@@ -50,8 +68,19 @@ def main(host: str = 'localhost', port: int = 9090) -> None:
     except KeyboardInterrupt:
         print("Shutting down")
     finally:
+        if pool is not None:
+            logging.info("Pool: %s", pool.stats())
         serversocket.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser("Multithreaded TCP echo server")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    parser.add_argument("--workers", dest="workers", type=int, default=0,
+                        help="size of the worker pool, 0 starts a thread per connection")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=64)
+    parser.add_argument("--policy", dest="policy", choices=workerpool.POLICIES, default="reject")
+    parser.add_argument("--stats-interval", dest="stats_interval", type=float, default=10.0)
+    args = parser.parse_args()
+    main(args.host, args.port, args.workers, args.queue_size, args.policy, args.stats_interval)
\ No newline at end of file
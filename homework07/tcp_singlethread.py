@@ -1,3 +1,4 @@
+import argparse
 import socket
 
 def main(host: str = 'localhost', port: int = 9090) -> None:
@@ -39,4 +40,8 @@ def main(host: str = 'localhost', port: int = 9090) -> None:
         serversocket.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser("Single-threaded TCP echo server")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    args = parser.parse_args()
+    main(args.host, args.port)
@@ -223,5 +223,6 @@ class NewRunner(unittest.TextTestRunner):
     resultclass = NewResult
 
 
-runner = NewRunner(verbosity=2)
-runner.run(suite)
+if __name__ == "__main__":
+    runner = NewRunner(verbosity=2)
+    runner.run(suite)
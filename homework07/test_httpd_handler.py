@@ -0,0 +1,63 @@
+import asyncio
+import os
+import unittest
+
+import httpd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class NoSendfileLoop(asyncio.SelectorEventLoop):
+    # like uvloop, which inherits sendfile from AbstractEventLoop
+
+    async def sendfile(self, transport, file, offset=0, count=None, *, fallback=True):
+        raise NotImplementedError
+
+
+async def fetch(request):
+    server = await asyncio.get_running_loop().create_server(
+        httpd.AsyncHTTPRequestHandler, "127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(request)
+        response = await asyncio.wait_for(reader.read(), 5.0)
+        writer.close()
+    finally:
+        server.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return head.split(b"\r\n")[0], body
+
+
+class TestAsyncHTTPRequestHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.document_root = httpd.DOCUMENT_ROOT
+        httpd.DOCUMENT_ROOT = os.path.join(HERE, "test_www")
+
+    def tearDown(self):
+        httpd.DOCUMENT_ROOT = self.document_root
+        httpd.AsyncHTTPRequestHandler.file_cache.clear()
+
+    def run_request(self, request, loop=None):
+        loop = loop or asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(fetch(request))
+        finally:
+            loop.close()
+
+    def test_file_without_loop_sendfile(self):
+        """A loop without sendfile support streams the file instead"""
+        status, body = self.run_request(
+            b"GET /dir1/bootstrap.css HTTP/1.1\r\nConnection: close\r\n\r\n", NoSendfileLoop())
+        self.assertEqual(status, b"HTTP/1.1 200 OK")
+        with open(os.path.join(HERE, "test_www", "dir1", "bootstrap.css"), "rb") as f:
+            self.assertEqual(body, f.read())
+
+    def test_nul_in_path(self):
+        """A NUL byte in the decoded path is answered with 400"""
+        status, _ = self.run_request(b"GET /dir1/page.html%00.txt HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual(status, b"HTTP/1.1 400 Bad Request")
+
+
+if __name__ == "__main__":
+    unittest.main()
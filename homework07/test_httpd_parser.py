@@ -0,0 +1,87 @@
+import unittest
+
+from httpd import HTTPParseError, HTTPRequestParser
+
+
+def parse(data, **kwargs):
+    parser = HTTPRequestParser(**kwargs)
+    parser.feed(data)
+    return parser.parse()
+
+
+class TestHTTPRequestParser(unittest.TestCase):
+
+    def test_request_line(self):
+        """Request line fields are returned apart from the headers"""
+        request = parse(b"GET /dir1/page.html HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        self.assertEqual(request.method, "GET")
+        self.assertEqual(request.uri, "/dir1/page.html")
+        self.assertEqual(request.protocol, "HTTP/1.1")
+        self.assertEqual(request.headers, {"host": "localhost"})
+
+    def test_header_cannot_override_request_line(self):
+        """Headers named like request line fields stay headers"""
+        request = parse(b"GET /dir1/page.html HTTP/1.1\r\n"
+                        b"uri: /dir1/text..txt\r\nmethod: POST\r\nprotocol: HTTP/1.0\r\n\r\n")
+        self.assertEqual(request.method, "GET")
+        self.assertEqual(request.uri, "/dir1/page.html")
+        self.assertEqual(request.protocol, "HTTP/1.1")
+        self.assertEqual(request.headers["uri"], "/dir1/text..txt")
+        self.assertEqual(request.headers["method"], "POST")
+
+    def test_header_names_lower_case(self):
+        """Header names are lower-cased, values keep their case"""
+        request = parse(b"GET / HTTP/1.1\r\nContent-TYPE: Text/Plain\r\nX-Test:  value \r\n\r\n")
+        self.assertEqual(request.headers, {"content-type": "Text/Plain", "x-test": "value"})
+
+    def test_repeated_header(self):
+        """Repeated fields are combined in order"""
+        request = parse(b"GET / HTTP/1.1\r\nX-A: 1\r\nAccept: text/html\r\nx-a: 2\r\n\r\n")
+        self.assertEqual(request.headers["x-a"], "1, 2")
+        self.assertEqual(request.headers["accept"], "text/html")
+
+    def test_incremental(self):
+        """A request split over several reads is parsed once complete"""
+        parser = HTTPRequestParser()
+        data = b"GET /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        for i in range(len(data) - 1):
+            parser.feed(data[i:i + 1])
+            self.assertIsNone(parser.parse())
+        parser.feed(data[-1:])
+        self.assertEqual(parser.parse().uri, "/index.html")
+
+    def test_pipelined(self):
+        """Pipelined requests are returned one by one"""
+        parser = HTTPRequestParser()
+        parser.feed(b"\r\nGET /a HTTP/1.1\r\n\r\nHEAD /b HTTP/1.0\r\nX: y\r\n\r\nGET /c")
+        first, second = parser.parse(), parser.parse()
+        self.assertEqual((first.method, first.uri, first.headers), ("GET", "/a", {}))
+        self.assertEqual((second.method, second.uri, second.protocol), ("HEAD", "/b", "HTTP/1.0"))
+        self.assertIsNone(parser.parse())
+        self.assertEqual(bytes(parser.buffer), b"GET /c")
+
+    def test_bad_request_line(self):
+        """Malformed request lines are rejected with 400"""
+        for data in (b"GET /\r\n\r\n", b"GET / FTP/1.0\r\n\r\n", b"GET / HTTP/1.1 x\r\n\r\n"):
+            with self.assertRaises(HTTPParseError) as e:
+                parse(data)
+            self.assertEqual(e.exception.code, 400)
+
+    def test_header_without_colon(self):
+        """A header line without a colon is rejected with 400"""
+        with self.assertRaises(HTTPParseError) as e:
+            parse(b"GET / HTTP/1.1\r\nno colon\r\n\r\n")
+        self.assertEqual(e.exception.code, 400)
+
+    def test_header_limits(self):
+        """Too large or too many headers are rejected with 431"""
+        with self.assertRaises(HTTPParseError) as e:
+            parse(b"GET / HTTP/1.1\r\nX: " + b"a" * 100 + b"\r\n\r\n", max_header_size=64)
+        self.assertEqual(e.exception.code, 431)
+        with self.assertRaises(HTTPParseError) as e:
+            parse(b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * 3 + b"\r\n", max_headers=2)
+        self.assertEqual(e.exception.code, 431)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,337 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import signal
+import socket
 import threading
 import time
 
-def loop():
-    while True:
-        time.sleep(1)
+MESSAGE = b"ping"
 
-def main():
-    for _ in range(10000):
-        t = threading.Thread(target=loop)
-        t.start()
-        print(threading.active_count())
 
+def echo_blocking(sock: socket.socket) -> None:
+    try:
+        while True:
+            data = sock.recv(1024)
+            if not data:
+                break
+            sock.sendall(data)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def echo_process(sock: socket.socket) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    echo_blocking(sock)
+
+
+async def echo_task(loop, sock: socket.socket) -> None:
+    try:
+        while True:
+            data = await loop.sock_recv(sock, 1024)
+            if not data:
+                break
+            await loop.sock_sendall(sock, data)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def memory(pid="self"):
+    # Rss counts pages shared after fork once per process, Pss splits them
+    # between the sharers so it adds up over the parent and its children
+    usage = {"Rss": 0, "Pss": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in usage:
+                    usage[key] = int(value.split()[0]) * 1024
+    except OSError:
+        if pid == "self":
+            usage["Rss"] = usage["Pss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return usage["Rss"], usage["Pss"]
+
+
+def context_switches():
+    # system wide, a unit blocked on another process or thread costs a
+    # switch whichever model it belongs to
+    try:
+        with open("/proc/stat") as f:
+            for line in f:
+                if line.startswith("ctxt "):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_nvcsw + usage.ru_nivcsw
+
+
+class ThreadModel:
+    name = "threads"
+
+    def __init__(self) -> None:
+        self.clients = []
+        self.threads = []
+
+    def start(self) -> None:
+        pass
+
+    def add(self, count: int) -> None:
+        for _ in range(count):
+            client, server = socket.socketpair()
+            try:
+                thread = threading.Thread(target=echo_blocking, args=(server,), daemon=True)
+                thread.start()
+            except RuntimeError:
+                client.close()
+                server.close()
+                raise
+            self.clients.append(client)
+            self.threads.append(thread)
+
+    def memory(self):
+        return memory()
+
+    def close(self) -> None:
+        for client in self.clients:
+            client.close()
+        for thread in self.threads:
+            thread.join(1.0)
+
+
+class TaskModel:
+    name = "asyncio"
+
+    def __init__(self) -> None:
+        self.clients = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="event-loop", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def add(self, count: int) -> None:
+        # the tasks are created in one batch on the loop thread, whatever
+        # was set up before running out of descriptors is still started
+        pairs = []
+        error = None
+        try:
+            for _ in range(count):
+                pairs.append(socket.socketpair())
+        except OSError as e:
+            error = e
+
+        async def spawn():
+            for _, server in pairs:
+                server.setblocking(False)
+                self.loop.create_task(echo_task(self.loop, server))
+
+        asyncio.run_coroutine_threadsafe(spawn(), self.loop).result()
+        self.clients.extend(client for client, _ in pairs)
+        if error is not None:
+            raise error
+
+    def memory(self):
+        return memory()
+
+    def close(self) -> None:
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        for client in self.clients:
+            client.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class ProcessModel:
+    name = "processes"
+
+    def __init__(self) -> None:
+        self.clients = []
+        self.processes = []
+        self.context = multiprocessing.get_context("fork")
+
+    def start(self) -> None:
+        pass
+
+    def add(self, count: int) -> None:
+        for _ in range(count):
+            client, server = socket.socketpair()
+            try:
+                process = self.context.Process(target=echo_process, args=(server,), daemon=True)
+                process.start()
+            except OSError:
+                client.close()
+                raise
+            finally:
+                server.close()
+            self.clients.append(client)
+            self.processes.append(process)
+
+    def memory(self):
+        rss, pss = memory()
+        for process in self.processes:
+            child_rss, child_pss = memory(process.pid)
+            rss += child_rss
+            pss += child_pss
+        return rss, pss
+
+    def close(self) -> None:
+        for client in self.clients:
+            client.close()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+
+MODELS = {model.name: model for model in (ThreadModel, TaskModel, ProcessModel)}
+
+
+def ping(client: socket.socket) -> None:
+    client.sendall(MESSAGE)
+    received = 0
+    while received < len(MESSAGE):
+        data = client.recv(len(MESSAGE) - received)
+        if not data:
+            raise ConnectionError("echo connection closed")
+        received += len(data)
+
+
+def measure_echo(clients, samples: int):
+    latencies = []
+    switches = context_switches()
+    for client in random.choices(clients, k=samples):
+        started = time.perf_counter()
+        ping(client)
+        latencies.append(time.perf_counter() - started)
+    switches = context_switches() - switches
+    latencies.sort()
+    return (latencies[len(latencies) // 2], latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)],
+            switches / samples)
+
+
+def levels(limit: int):
+    # doubling until the first failure; add() creates units one at a time
+    # and keeps the ones created before it failed, so the count reached
+    # in the failing step is the largest one that succeeded
+    level = 1
+    while level < limit:
+        yield level
+        level *= 2
+    yield limit
+
+
+def probe(name: str, limit: int, samples: int, report) -> None:
+    model = MODELS[name]()
+    model.start()
+    base_rss, base_pss = model.memory()
+    try:
+        for level in levels(limit):
+            started = time.perf_counter()
+            added = level - len(model.clients)
+            error = None
+            try:
+                model.add(added)
+            except (OSError, RuntimeError, MemoryError) as e:
+                error = f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - started
+            units = len(model.clients)
+            if not units:
+                break
+
+            rss, pss = model.memory()
+            p50, p99, switches = measure_echo(model.clients, samples)
+            row = {
+                "model": name,
+                "units": units,
+                "create_us": round(elapsed / max(added, 1) * 1e6, 1),
+                "rss_kb": round((rss - base_rss) / units / 1024, 1),
+                "pss_kb": round((pss - base_pss) / units / 1024, 1),
+                "echo_p50_us": round(p50 * 1e6, 1),
+                "echo_p99_us": round(p99 * 1e6, 1),
+                "ctxt_per_echo": round(switches, 2),
+                "error": error,
+            }
+            print(f"{name:>10} {units:>7} {row['create_us']:>10} {row['rss_kb']:>8} {row['pss_kb']:>8} "
+                  f"{row['echo_p50_us']:>8} {row['echo_p99_us']:>8} {row['ctxt_per_echo']:>6}"
+                  + (f"  stopped by {error}" if error else ""), flush=True)
+            # sent one by one, so the levels already measured survive a
+            # probe that is killed when the system runs out of memory
+            report(row)
+            if error:
+                break
+    finally:
+        model.close()
+
+
+def raise_fd_limit() -> None:
+    # every unit holds both ends of a socketpair
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(models, limits, samples: int = 500, output=None) -> None:
+    raise_fd_limit()
+    print(f"{'model':>10} {'units':>7} {'create us':>10} {'rss kb':>8} {'pss kb':>8} "
+          f"{'p50 us':>8} {'p99 us':>8} {'ctxt':>6}")
+    # every model runs in a fresh process so memory released by the one
+    # before does not show up as a negative cost per unit
+    context = multiprocessing.get_context("fork")
+    results = []
+    max_units = {}
+    for name in models:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=probe, args=(name, limits[name], samples, sender.send))
+        process.start()
+        sender.close()
+        rows = []
+        while True:
+            try:
+                rows.append(receiver.recv())
+            except EOFError:
+                break
+        process.join()
+        if process.exitcode:
+            print(f"{name:>10} probe exited with code {process.exitcode}")
+        if rows:
+            last = rows[-1]
+            max_units[name] = last["units"]
+            print(f"{name:>10} max {last['units']} units, "
+                  + (f"stopped by {last['error']}" if last["error"] else f"limit of {limits[name]} reached"),
+                  flush=True)
+        results.extend(rows)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "max_units": max_units, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Threads, asyncio tasks and processes serving one echo connection each")
+    parser.add_argument("models", nargs="*", default=list(MODELS), help=", ".join(MODELS))
+    parser.add_argument("--threads", dest="threads", type=int, default=10000)
+    parser.add_argument("--tasks", dest="asyncio", type=int, default=100000)
+    parser.add_argument("--processes", dest="processes", type=int, default=1000)
+    parser.add_argument("--samples", dest="samples", type=int, default=500)
+    parser.add_argument("--json", dest="output", default=None)
+    args = parser.parse_args()
+    for name in args.models:
+        if name not in MODELS:
+            parser.error(f"unknown model {name!r}")
+    main(args.models, {name: getattr(args, name) for name in MODELS}, args.samples, args.output)
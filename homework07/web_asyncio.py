@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 from asyncio import StreamReader, StreamWriter
 
@@ -15,16 +16,24 @@ async def client_handler(reader: StreamReader, writer: StreamWriter) -> None:
     writer.close()
 
 
-loop = asyncio.get_event_loop()
-coro = asyncio.start_server(client_handler, '127.0.0.1', 9090, loop=loop)
-server = loop.run_until_complete(coro)
+def main(host: str = '127.0.0.1', port: int = 9090) -> None:
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(client_handler, host, port))
 
-print('Serving on {}'.format(server.sockets[0].getsockname()))
-try:
-    loop.run_forever()
-except KeyboardInterrupt:
-    pass
+    print('Serving on {}'.format(server.sockets[0].getsockname()))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
 
-server.close()
-loop.run_until_complete(server.wait_closed())
-loop.close()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Asyncio web server")
+    parser.add_argument("--host", dest="host", default="127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    args = parser.parse_args()
+    main(args.host, args.port)
@@ -1,7 +1,11 @@
+import argparse
+import logging
 import socket
 import threading
 import time
 
+import workerpool
+
 
 def client_handler(sock: socket.socket):
     _ = sock.recv(1024)
@@ -15,15 +19,36 @@ def client_handler(sock: socket.socket):
     sock.close()
 
 
-def main(host: str = 'localhost', port: int = 9090) -> None:
+def reject_client(sock: socket.socket):
+    # the request is not read, a full queue answers straight away
+    sock.sendall(
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Retry-After: 1\r\n"
+        b"Content-Length: 0\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+    sock.close()
+
+
+def main(host: str = 'localhost', port: int = 9090, workers: int = 0, queue_size: int = 64,
+         policy: str = "reject", stats_interval: float = 10.0) -> None:
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
     sock.bind((host, port))
     sock.listen(128)
+
+    pool = None
+    if workers:
+        pool = workerpool.WorkerPool(client_handler, workers, queue_size, policy, reject_client)
+        pool.report_every(stats_interval)
+
     print(f"Starting Web Server at {host}:{port}")
     try:
         while True:
             client_sock, (client_addr, client_port) = sock.accept()
+            if pool is not None:
+                pool.submit(client_sock)
+                continue
             client_thread = threading.Thread(
                 target=client_handler,
                 args=(client_sock,))
@@ -32,9 +57,21 @@ def main(host: str = 'localhost', port: int = 9090) -> None:
     except KeyboardInterrupt:
         print("Shutting down")
     finally:
+        if pool is not None:
+            print(f"Pool: {pool.stats()}")
         sock.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser("Multithreaded web server")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    parser.add_argument("--workers", dest="workers", type=int, default=0,
+                        help="size of the worker pool, 0 starts a thread per connection")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=64)
+    parser.add_argument("--policy", dest="policy", choices=workerpool.POLICIES, default="reject")
+    parser.add_argument("--stats-interval", dest="stats_interval", type=float, default=10.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(args.host, args.port, args.workers, args.queue_size, args.policy, args.stats_interval)
 
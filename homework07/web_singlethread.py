@@ -1,3 +1,4 @@
+import argparse
 import socket
 import time
 
@@ -26,4 +27,8 @@ def main(host: str = 'localhost', port: int = 9090) -> None:
         serversocket.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser("Single-threaded web server")
+    parser.add_argument("--host", dest="host", default="localhost")
+    parser.add_argument("--port", dest="port", type=int, default=9090)
+    args = parser.parse_args()
+    main(args.host, args.port)
@@ -0,0 +1,119 @@
+import collections
+import logging
+import queue
+import threading
+from time import monotonic, sleep
+
+log = logging.getLogger(__name__)
+
+POLICIES = ("block", "reject", "drop-oldest")
+
+
+class WorkerPool:
+    # a fixed number of threads take accepted connections from a bounded
+    # queue; when the queue is full the policy decides whether the accept
+    # loop waits (block), the new connection is turned away (reject) or
+    # the one that has waited longest is (drop-oldest)
+
+    def __init__(self, handler, workers: int = 16, queue_size: int = 64,
+                 policy: str = "reject", on_reject=None) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"unknown rejection policy {policy!r}")
+        self.handler = handler
+        self.workers = workers
+        self.policy = policy
+        self.on_reject = on_reject
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.started = monotonic()
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.running = {}
+        self.busy_time = 0.0
+        self.waits = collections.deque(maxlen=4096)
+        self.max_wait = 0.0
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.run, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, *args) -> bool:
+        item = (monotonic(), args)
+        self.submitted += 1
+        if self.policy == "block":
+            self.queue.put(item)
+            return True
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                pass
+            if self.policy == "reject":
+                self.reject(args)
+                return False
+            try:
+                _, oldest = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.reject(oldest)
+
+    def reject(self, args) -> None:
+        with self.lock:
+            self.rejected += 1
+        if self.on_reject is not None:
+            try:
+                self.on_reject(*args)
+            except OSError:
+                pass
+
+    def run(self) -> None:
+        while True:
+            enqueued, args = self.queue.get()
+            started = monotonic()
+            worker = threading.get_ident()
+            with self.lock:
+                self.running[worker] = started
+                self.waits.append(started - enqueued)
+                self.max_wait = max(self.max_wait, started - enqueued)
+            try:
+                self.handler(*args)
+            except Exception:
+                log.exception("Error in worker")
+            finally:
+                with self.lock:
+                    del self.running[worker]
+                    self.completed += 1
+                    self.busy_time += monotonic() - started
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = monotonic()
+            elapsed = now - self.started
+            # connections still being served count towards utilisation too
+            busy_time = self.busy_time + sum(now - started for started in self.running.values())
+            waits = sorted(self.waits)
+            stats = {
+                "workers": self.workers,
+                "active": len(self.running),
+                "queued": self.queue.qsize(),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "utilisation": round(busy_time / (elapsed * self.workers), 3) if elapsed else 0.0,
+                "wait_max_ms": round(self.max_wait * 1000, 3),
+            }
+        for name, q in (("wait_p50_ms", 0.5), ("wait_p99_ms", 0.99)):
+            stats[name] = round(waits[int(q * (len(waits) - 1))] * 1000, 3) if waits else 0.0
+        return stats
+
+    def report_every(self, interval: float) -> None:
+        def report():
+            while True:
+                sleep(interval)
+                log.info("Pool: %s", self.stats())
+
+        threading.Thread(target=report, name="pool-stats", daemon=True).start()